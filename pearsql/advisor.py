@@ -0,0 +1,256 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+from collections import OrderedDict
+
+import six
+
+from .builder import SqlQuery, SqlException, _SqlColumn, _SqlTable, _SqlWhereCondition, \
+    _SqlWhereConditionType, _SqlOperationType, _ROWID_NAMES
+from .explain import explain
+from .schema import SqlSchemaException
+
+_EQUALITY = (_SqlWhereConditionType.EQ, _SqlWhereConditionType.IN)
+_RANGE = (_SqlWhereConditionType.GREATER, _SqlWhereConditionType.LESS, _SqlWhereConditionType.GEQ,
+          _SqlWhereConditionType.LEQ, _SqlWhereConditionType.BETWEEN)
+
+# Estimated benefit of an index per execution: Equality lookups narrow down the most
+_EQUALITY_SCORE = 4
+_RANGE_SCORE = 2
+_SORT_SCORE = 1
+
+
+# Terms of the top-level AND of the conditions
+def _conjuncts(conditions):
+    stack = list(reversed(conditions))
+    while stack:
+        c = stack.pop()
+        if isinstance(c, _SqlWhereCondition) and c._type == _SqlWhereConditionType.AND:
+            stack.extend(reversed(c._operands()))
+        else:
+            yield c
+
+
+# (column, is equality, is join) of the columns an index could look up to evaluate the condition. Join lookups
+# compare with a column of another table
+# noinspection PyProtectedMember
+def _lookups(condition):
+    if not isinstance(condition, _SqlWhereCondition):
+        return []
+    if condition._type in _EQUALITY:
+        equality = True
+    elif condition._type in _RANGE:
+        equality = False
+    else:
+        return []
+
+    lookups = []
+    op1, op2 = condition._op1, condition._op2
+    if isinstance(op1, _SqlColumn) and not (isinstance(op2, _SqlColumn) and op2.table._name == op1.table._name):
+        lookups.append((op1, equality, isinstance(op2, _SqlColumn)))
+    if condition._type != _SqlWhereConditionType.IN and isinstance(op2, _SqlColumn) and \
+            not (isinstance(op1, _SqlColumn) and op1.table._name == op2.table._name):
+        lookups.append((op2, equality, isinstance(op1, _SqlColumn)))
+    return lookups
+
+
+class _SqlIndexCandidate(object):
+    __slots__ = ("table", "equality", "tail", "score")
+
+    def __init__(self, table, equality, tail, score):
+        self.table = table
+        self.equality = equality
+        self.tail = tail
+        self.score = score
+
+
+# Index candidates of a select, update or delete: For each table its equality columns, followed by one
+# range column or the columns avoiding a sort. The lookups of a table in joins and its filters are separate
+# candidates, as SQLite uses one index per table in a nested loop. rowid_names(table) are the lowercased names
+# of the rowid of a table, which needs no index: They are left out of the candidates
+# noinspection PyProtectedMember
+def _candidates(query, rowid_names):
+    lookups = [l for c in _conjuncts(query._wheres) for l in _lookups(c)]
+    for j in query._joins:
+        lookups.extend(l for c in _conjuncts([j.condition]) for l in _lookups(c)
+                       if l[0].table._name == j.other_table._name)
+
+    tables = OrderedDict()
+    for column, equality, join in lookups:
+        entry = tables.setdefault((column.table._name, join), ([], []))
+        entry[0 if equality else 1].append(column.column)
+
+    sorted_columns = [c for _, c in query._orderby_table.values()] or list(query._groupby_list)
+    sorted_columns = [c for c in sorted_columns if isinstance(c, _SqlColumn)]
+    sort_table = sorted_columns[0].table._name if sorted_columns and \
+        all(c.table._name == sorted_columns[0].table._name for c in sorted_columns) else None
+    if sort_table is not None:
+        tables.setdefault((sort_table, False), ([], []))
+
+    candidates = []
+    for (table, join), (equality, ranges) in tables.items():
+        rowid = rowid_names(table)
+        equality = [c for c in OrderedDict.fromkeys(equality) if c.lower() not in rowid]
+        ranges = [c for c in ranges if c not in equality and c.lower() not in rowid]
+        score = _EQUALITY_SCORE * len(equality)
+        tail = []
+        if ranges:
+            tail = [ranges[0]]
+            score += _RANGE_SCORE
+        elif table == sort_table and not join:
+            for c in sorted_columns:
+                if c.column.lower() in rowid:  # Unique, rows are in rowid order for equal index entries
+                    break
+                if c.column not in equality:
+                    tail.append(c.column)
+            score += _SORT_SCORE if tail else 0
+        if equality or tail:
+            candidates.append(_SqlIndexCandidate(table, equality, tail, score))
+    return candidates
+
+
+def _serves(columns, equality, tail):
+    n = len(equality)
+    return set(columns[:n]) == set(equality) and columns[n:n + len(tail)] == tail
+
+
+class SqlIndexAdvice(object):
+    def __init__(self, query, name, benefit, queries):
+        self.query = query
+        self.name = name
+        self.benefit = benefit
+        self.queries = queries
+        self.verified = None
+
+    def __repr__(self):
+        return "SqlIndexAdvice(%r, %s)" % (self.query.build(), self.benefit)
+
+
+# Fails on a source connection with an open transaction, which would block the backup
+def _backup(database, target):
+    def backup(source):
+        if source.in_transaction:
+            raise SqlException("Cannot copy a database with an open transaction, commit it first")
+        source.backup(target)
+
+    if isinstance(database, six.string_types):
+        source = sqlite3.connect(database)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+    elif hasattr(database, "connection"):  # pearsql.engine.SqlEngine
+        with database.connection() as source:
+            backup(source)
+    else:
+        backup(database)
+
+
+# Proposes indexes for a recorded workload of queries, ranked by their estimated benefit: the columns the
+# queries filter, join, group and sort on, weighted by how often each query runs. Candidates served by a wider
+# proposed index or an existing index (with a reflected schema) are merged away, and rowid columns left out.
+# Also usable as instrumentation hook (pearsql.instrument.add_hook), recording the executed queries
+class SqlIndexAdvisor(object):
+    def __init__(self, schema=None):
+        self.schema = schema
+        self._workload = OrderedDict()
+
+    # noinspection PyProtectedMember
+    def record(self, query, count=1):
+        if not isinstance(query, SqlQuery) or query._operation not in (
+                _SqlOperationType.SELECT, _SqlOperationType.UPDATE, _SqlOperationType.DELETE):
+            return
+        key = query.structural_key(False)
+        entry = self._workload.get(key)
+        if entry is None:
+            self._workload[key] = [query, count]
+        else:
+            entry[1] += count
+
+    def __call__(self, event):
+        if event.kind == "execute":
+            self.record(event.query)
+
+    def _rowid_names(self, table):
+        names = set(_ROWID_NAMES)
+        if self.schema is not None:
+            try:
+                rowid = self.schema.table_info(table).rowid_column
+            except SqlSchemaException:
+                rowid = None
+            if rowid is not None:
+                names.add(rowid.name.lower())
+        return names
+
+    def _is_served(self, table, equality, tail):
+        if self.schema is None:
+            return False
+        try:
+            info = self.schema.table_info(table)
+        except SqlSchemaException:
+            return False
+        if info.view:
+            return True
+        return any(_serves([c.lower() for c in i.columns], [c.lower() for c in equality],
+                           [c.lower() for c in tail]) for i in info.indexes if not i.partial)
+
+    # noinspection PyProtectedMember
+    def advise(self, max_indexes=None):
+        candidates = []
+        usage = {}
+        for query, count in self._workload.values():
+            for c in _candidates(query, self._rowid_names):
+                candidates.append((c, query, count))
+                for column in c.equality:
+                    usage[(c.table, column)] = usage.get((c.table, column), 0) + count
+
+        # Equality columns used by most queries first, so indexes share their prefixes
+        proposals = OrderedDict()
+        for c, query, count in candidates:
+            if self._is_served(c.table, c.equality, c.tail):
+                continue
+            columns = tuple(sorted(c.equality, key=lambda e: (-usage[(c.table, e)], e))) + tuple(c.tail)
+            proposal = proposals.setdefault((c.table, columns), [0, [], []])
+            proposal[0] += count * c.score
+            proposal[1].append(query)
+            proposal[2].append(c)
+
+        chosen = []
+        for (table, columns), (benefit, queries, cs) in sorted(proposals.items(), key=lambda p: -len(p[0][1])):
+            for other in chosen:
+                if other[0] == table and all(_serves(list(other[1]), c.equality, c.tail) for c in cs):
+                    other[2] += benefit
+                    other[3].extend(q for q in queries if q not in other[3])
+                    break
+            else:
+                chosen.append([table, columns, benefit, list(queries)])
+
+        chosen.sort(key=lambda c: -c[2])
+        advices = []
+        for table, columns, benefit, queries in chosen[:max_indexes]:
+            name = "idx_%s_%s" % (table, "_".join(columns))
+            query = SqlQuery.create_index(*[_SqlTable._intern(table)._column(c) for c in columns])
+            advices.append(SqlIndexAdvice(query.name(name), name, benefit, queries))
+        return advices
+
+    # Creates the advised indexes on a scratch copy of the database (path, connection or engine) and sets
+    # verified on each advice: whether SQLite uses the index for any of its queries
+    def verify(self, database, advices=None):
+        advices = self.advise() if advices is None else advices
+        directory = tempfile.mkdtemp(prefix="pearsql-")
+        try:
+            scratch = sqlite3.connect(os.path.join(directory, "scratch.db"))
+            try:
+                _backup(database, scratch)
+                for advice in advices:
+                    scratch.execute(advice.query.build())
+                for advice in advices:
+                    used = " INDEX %s" % advice.name
+                    advice.verified = any(used in node.detail
+                                          for q in advice.queries for node in explain(q, scratch).nodes)
+            finally:
+                scratch.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return advices
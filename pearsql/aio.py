@@ -0,0 +1,131 @@
+import asyncio
+import collections
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .builder import _statement
+from .engine import SqlEngine, _row_type
+from .instrument import _hooks, _notify, clock
+
+
+# Cursor of a stream, opened, read and closed by separate calls on a worker
+class _SqlAsyncCursor:
+    def __init__(self, engine, query, params):
+        self.engine = engine
+        self.query = query
+        self.params = params
+        self._context = None
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        self._context = self.engine.connection()
+        self._conn = self._context.__enter__()
+        try:
+            self.sql, self.params = _statement(self.query, self.params)
+            self._start = clock() if _hooks else None
+            self._cursor = self.engine._execute_statement(self._conn, self.query, self.sql, self.params)
+            self._make = _row_type(self.query, self._cursor)._make
+            self._count = 0
+        except BaseException:
+            context, self._context = self._context, None
+            context.__exit__(*sys.exc_info())
+            raise
+
+    def fetch(self, batch_size):
+        with self._lock:
+            if self._context is None:
+                return []
+            batch = self._cursor.fetchmany(batch_size)
+            self._count += len(batch)
+            return list(map(self._make, batch))
+
+    def close(self):
+        with self._lock:
+            context, self._context = self._context, None
+            if context is None:
+                return
+            try:
+                self._cursor.close()
+                if self._start is not None:
+                    _notify("execute", self.query, self.sql, self.params, clock() - self._start, self._count,
+                            self._conn)
+            finally:
+                context.__exit__(None, None, None)
+
+
+# Runs the blocking engine calls on a dedicated executor with one worker per pooled connection
+class SqlAsyncEngine:
+    def __init__(self, database, pool_size=4, **kwargs):
+        self.engine = SqlEngine(database, pool_size=pool_size, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=self.engine.pool_size, thread_name_prefix="pearsql")
+        self._cursors = set()
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def execute(self, query, params=None):
+        return await self._run(self.engine.execute, query, params)
+
+    async def fetchall(self, query, params=None):
+        return await self._run(self.engine.fetchall, query, params)
+
+    async def fetchone(self, query, params=None):
+        return await self._run(self.engine.fetchone, query, params)
+
+    async def fetch_columns(self, query, params=None, batch_size=4096, numpy=False):
+        return await self._run(self.engine.fetch_columns, query, params, batch_size, numpy)
+
+    async def executemany(self, query, rows):
+        return await self._run(self.engine.executemany, query, rows)
+
+    # Rows are fetched in batches of batch_size on a worker, at most 'prefetch' batches ahead of the consumer.
+    # The cursor keeps its connection between the batches. With a single pooled connection (':memory:'), streams
+    # run on the worker of the other calls, which reuse the connection of open streams like SqlEngine.stream().
+    # Otherwise each stream runs on its own thread
+    async def stream(self, query, params=None, batch_size=256, prefetch=2):
+        loop = asyncio.get_running_loop()
+        if self.engine.pool_size == 1:
+            executor = self._executor
+        else:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pearsql-stream")
+        cursor = _SqlAsyncCursor(self.engine, query, params)
+        self._cursors.add(cursor)
+        pending = collections.deque()
+        try:
+            await loop.run_in_executor(executor, cursor.open)
+            for _ in range(max(prefetch, 1)):
+                pending.append(loop.run_in_executor(executor, cursor.fetch, batch_size))
+            while True:
+                batch = await pending.popleft()
+                if not batch:
+                    break
+                pending.append(loop.run_in_executor(executor, cursor.fetch, batch_size))
+                for row in batch:
+                    yield row
+        finally:
+            if pending:
+                await asyncio.wait(pending)
+            try:
+                if cursor in self._cursors:  # Otherwise closed by close()
+                    self._cursors.discard(cursor)
+                    await loop.run_in_executor(executor, cursor.close)
+            finally:
+                if executor is not self._executor:
+                    executor.shutdown(wait=False)
+
+    # Streams abandoned without being closed release their connections here. The executor is shut down off the
+    # event loop, which its running calls may need
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        while self._cursors:
+            self._cursors.pop().close()
+        await self._run(self.engine.close)
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,156 @@
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+
+from .builder import SqlQuery as Q, SqlDatabase as D
+
+
+# Each benchmark constructs and renders a query. Sizes are chosen to run in milliseconds
+def wide_select(width=200):
+    query = Q.select(D.report.as_("r")).join(D.account.as_("a"), D.account.id == D.report.account_id)
+    query = query.columns(*[getattr(D.report, "c%i" % i).as_("r%i" % i) for i in range(width)])
+    query = query.where(*[getattr(D.report, "c%i" % i) > i for i in range(width)])
+    return query.groupby(*[getattr(D.report, "c%i" % i) for i in range(width)])
+
+
+def deep_and_or(terms=2000):
+    condition = D.item.id == 0
+    for i in range(1, terms):
+        term = (D.item.id == i) & (D.item.name != "item %i" % i)
+        condition = condition | term
+    return Q.select(D.item).where(condition)
+
+
+def large_in_list(size=10000):
+    return Q.select(D.item).where(D.item.id.in_(list(range(size))))
+
+
+def union_chain(length=50):
+    query = Q.select(D.log).columns(D.log.id).where(D.log.month == length)
+    for i in reversed(range(length)):
+        query = Q.select(D.log).columns(D.log.id).where(D.log.month == i).union(query)
+    return query
+
+
+def many_joins(count=30):
+    query = Q.select(D.t0.as_("a0")).columns(*[getattr(D, "t%i" % i).value.as_("v%i" % i) for i in range(count)])
+    for i in range(1, count):
+        table = getattr(D, "t%i" % i)
+        query = query.left_join(table.as_("a%i" % i), table.id == getattr(D, "t%i" % (i - 1)).next_id)
+    return query.where(D.t0.id > 5)
+
+
+def bulk_insert(count=10000):
+    rows = ((i, "name %i" % i, i % 2) for i in range(count))
+    return list(Q.insert(D.author).columns(D.author.id, D.author.name, D.author.gender).rows(rows))
+
+
+def bulk_update(count=1000):
+    return [Q.update(D.author).columns(D.author.name.set("name %i" % i)).where(D.author.id == i).build_params()
+            for i in range(count)]
+
+
+def bulk_upsert(count=10000):
+    rows = ((i, "name %i" % i, i % 2) for i in range(count))
+    query = Q.upsert(D.author).columns(D.author.id, D.author.name, D.author.gender).conflict(D.author.id)
+    return list(query.rows(rows))
+
+
+def batched_update(count=1000):
+    rows = ((i, "name %i" % i) for i in range(count))
+    return list(Q.update(D.author).columns(D.author.id, D.author.name).match(D.author.id).rows(rows))
+
+
+BENCHMARKS = [
+    ("wide_select", lambda: wide_select().build()),
+    ("wide_select_params", lambda: wide_select().build_params()),
+    ("deep_and_or", lambda: deep_and_or().build()),
+    ("large_in_list", lambda: large_in_list().build()),
+    ("large_in_list_params", lambda: large_in_list().build_params()),
+    ("union_chain", lambda: union_chain().build()),
+    ("many_joins", lambda: many_joins().build()),
+    ("bulk_insert", bulk_insert),
+    ("bulk_update", bulk_update),
+    ("bulk_upsert", bulk_upsert),
+    ("batched_update", batched_update),
+]
+
+
+def measure(func, repeat=5, min_time=0.2):
+    number = 1
+    while True:
+        t = timeit.timeit(func, number=number)
+        if t >= min_time:
+            break
+        number *= 2
+    best = min([t] + timeit.repeat(func, number=number, repeat=repeat - 1))
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"ops": number / best, "peak": peak}
+
+
+def run(names=None, repeat=5, min_time=0.2, out=sys.stdout):
+    results = {}
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        results[name] = measure(func, repeat, min_time)
+        if out:
+            print("%-22s %12.1f ops/s %10.1f KiB" % (name, results[name]["ops"], results[name]["peak"] / 1024.0),
+                  file=out)
+    return results
+
+
+# Returns the benchmarks which got slower than tolerance (fraction) compared to the baseline
+def compare(results, baseline, tolerance=0.2):
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name in baseline and result["ops"] < baseline[name]["ops"] * (1 - tolerance):
+            regressions.append((name, baseline[name]["ops"], result["ops"]))
+    return regressions
+
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pearsql.bench",
+                                     description="Benchmarks for query construction and rendering")
+    parser.add_argument("names", nargs="*", help="Benchmarks to run, all by default")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimal duration of a timing run in seconds")
+    parser.add_argument("--save", metavar="JSON", help="Save the results as baseline")
+    parser.add_argument("--compare", metavar="JSON", help="Compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before failing")
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.repeat, args.min_time)
+    if args.save:
+        save(results, args.save)
+    if args.compare:
+        regressions = compare(results, load(args.compare), args.tolerance)
+        for name, old, new in regressions:
+            print("REGRESSION %s: %.1f -> %.1f ops/s" % (name, old, new))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
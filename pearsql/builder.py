@@ -1,6 +1,15 @@
+import copy
+import hashlib
+import itertools
+import json
 import sys
+import threading
+from collections import OrderedDict
+import six
 from six import with_metaclass
 
+from .instrument import _hooks, _notify, clock
+
 PY3 = sys.version_info[0] == 3
 
 if PY3:
@@ -21,31 +30,200 @@ def _escape_str(s):
     return s.replace("'", "''")
 
 
-def _escape(query, obj):
-    if isinstance(obj, __string_types):
-        return "'%s'" % _escape_str(obj)
-    elif isinstance(obj, SqlQuery):
-        return "(" + obj.build(False, False) + ")"
-    elif isinstance(obj, _SqlTable):
-        alias = query.get_alias_for_table(obj)
-        if alias:
-            return "%s" % _enquote(query, alias)
-        else:
-            return obj.build(query)
-    elif isinstance(obj, _SqlColumn):
-        alias = query.get_alias_for_column(obj)
-        if alias:
-            return "%s" % _enquote(query, alias)
-        else:
-            alias = query.get_alias_for_table(obj.table)
-            if alias:
-                return "%s.%s" % (_enquote(query, alias), _enquote(query, obj.column))
-            else:
-                return obj.build(query)
-    elif hasattr(obj, "build"):
-        return obj.build(query)
+# noinspection PyProtectedMember
+def _bind(query, value):
+    query._params.append(value)
+    return "?"
+
+
+# Rendering: Every node appends its fragments to a shared output list 'out', which is joined once.
+# _emit() dispatches on the class of the object through _emitters, filled lazily per class
+def _emit(query, obj, out):
+    try:
+        emitter = _emitters[obj.__class__]
+    except KeyError:
+        emitter = _find_emitter(obj.__class__)
+    emitter(query, obj, out)
+
+
+# noinspection PyProtectedMember
+def _emit_string(query, s, out):
+    if query._params is not None:
+        out.append(_bind(query, s))
+    else:
+        out.append("'%s'" % _escape_str(s))
+
+
+# noinspection PyProtectedMember
+def _emit_literal(query, obj, out):
+    if query._params is not None:
+        out.append(_bind(query, obj))
+    else:
+        out.append(str(obj))
+
+
+# noinspection PyProtectedMember
+def _emit_query(query, obj, out):
+    out.append("(")
+    _render_nested(out, obj, False, query._params)
+    out.append(")")
+
+
+# Output of iter_build(): Nested queries are recorded as (query, beautiful, complete) instead of being rendered
+class _SqlDeferredOutput(list):
+    __slots__ = ()
+
+
+def _render_nested(out, query, beautiful, params):
+    if out.__class__ is _SqlDeferredOutput:
+        out.append((query, beautiful, False))
+    else:
+        query._render_into(out, beautiful, False, params)
+
+
+# noinspection PyProtectedMember
+def _table_ref(query, table):
+    alias = query.get_alias_for_table(table)
+    if alias:
+        return _enquote(query, alias)
+    else:
+        return _enquote(query, table._name)
+
+
+def _emit_table(query, table, out):
+    out.append(_table_ref(query, table))
+
+
+# noinspection PyProtectedMember
+def _emit_column(query, column, out):
+    alias = query.get_alias_for_column(column)
+    if alias:
+        out.append(_enquote(query, alias))
+    else:
+        out.append(_table_ref(query, column.table) + "." + _enquote(query, column.column))
+
+
+# noinspection PyProtectedMember
+def _emit_node(query, obj, out):
+    render = getattr(obj, "_render", None)
+    if render is not None:
+        render(query, out)
     else:
-        return str(obj)
+        out.append(obj.build(query))
+
+
+def _find_emitter(cls):
+    for base in cls.__mro__:
+        if base in _emitters:
+            emitter = _emitters[base]
+            break
+    else:
+        emitter = _emit_node if hasattr(cls, "build") else _emit_literal
+    _emitters[cls] = emitter
+    return emitter
+
+
+# Output of the renderer for build_into(): Collects fragments and passes them joined to write() in chunks of
+# about chunk_size characters, so the statement is never held as a whole
+class _SqlChunkWriter(object):
+    __slots__ = ("_write", "_chunk", "_size", "_chunk_size")
+
+    def __init__(self, write, chunk_size):
+        self._write = write
+        self._chunk = []
+        self._size = 0
+        self._chunk_size = chunk_size
+
+    def append(self, s):
+        self._chunk.append(s)
+        self._size += len(s)
+        if self._size >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._chunk:
+            self._write("".join(self._chunk))
+            self._chunk = []
+            self._size = 0
+
+
+# write() of a file or io.StringIO, sendall() of a socket (UTF-8 encoded) or a plain function
+def _writer_function(writer):
+    if hasattr(writer, "write"):
+        return writer.write
+    elif hasattr(writer, "sendall"):
+        return lambda s: writer.sendall(s.encode("utf-8"))
+    elif callable(writer):
+        return writer
+    raise SqlException("Writer needs write() or sendall()")
+
+
+# Hashable description of a node, used to identify equal query trees without rendering them.
+# Without literals, values are only described by their type
+def _structure_key(obj, literals=True):
+    if hasattr(obj, "_structure_key"):
+        return obj._structure_key(literals)
+    elif isinstance(obj, (list, tuple)):
+        return tuple(_structure_key(e, literals) for e in obj)
+    elif literals:
+        return obj.__class__, obj
+    else:
+        return obj.__class__
+
+
+# Children of a node, with the entries of child lists (IN lists, junction operands)
+def _child_nodes(node):
+    for child in node._children():
+        if isinstance(child, (list, tuple)):
+            for e in child:
+                yield e
+        else:
+            yield child
+
+
+# Base of the immutable nodes, caching their structure keys. Nodes depending on a (mutable) query are not cached
+class _SqlNode(object):
+    __slots__ = ("_key", "_shape")
+
+    def _structure_key(self, literals=True):
+        try:
+            return self._key if literals else self._shape
+        except AttributeError:
+            pass
+
+        # The keys of uncached descendants are computed bottom-up with an explicit stack, like conditions are
+        # rendered, so deeply nested conditions don't hit the recursion limit
+        keys = {}
+
+        def key(obj):
+            if isinstance(obj, _SqlNode):
+                k = keys.get(id(obj))
+                return obj._structure_key(literals) if k is None else k
+            elif isinstance(obj, (list, tuple)):
+                return tuple(key(e) for e in obj)
+            return _structure_key(obj, literals)
+
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            if ready:
+                k = keys[id(node)] = node._compute_key(key)
+                if all(not isinstance(c, SqlQuery) and (not isinstance(c, _SqlNode) or c._is_cached(literals))
+                       for c in _child_nodes(node)):
+                    if literals:
+                        node._key = k
+                    else:
+                        node._shape = k
+            elif id(node) not in keys and not node._is_cached(literals):
+                stack.append((node, True))
+                stack.extend((c, False) for c in _child_nodes(node) if isinstance(c, _SqlNode))
+        return keys[id(self)]
+
+    def _is_cached(self, literals):
+        return hasattr(self, "_key" if literals else "_shape")
+
+    def _children(self):
+        return ()
 
 
 class SqlException(Exception):
@@ -58,6 +236,7 @@ class _SqlOperationType:
     INSERT = 1
     SELECT = 2
     DELETE = 3
+    CREATE_INDEX = 4
 
 
 class _SqlWhereConditionType:
@@ -97,27 +276,45 @@ class _SqlJoinType:
     FULL = 3
 
 
-class _SqlJoin:
+class _SqlJoin(_SqlNode):
+    __slots__ = ("other_table", "condition", "type")
+
     def __init__(self, other_table, condition, type):
         self.other_table = other_table
         self.condition = condition
         self.type = type
 
+    _prefixes = {
+        _SqlJoinType.INNER: "INNER JOIN ",
+        _SqlJoinType.LEFT: "LEFT OUTER JOIN ",
+        _SqlJoinType.RIGHT: "RIGHT OUTER JOIN ",
+        _SqlJoinType.FULL: "FULL OUTER JOIN ",
+    }
+
     def build(self, query):
-        postfix = "JOIN %s ON %s" % (self.other_table.build(query, True), self.condition.build(query))
-        if self.type == _SqlJoinType.INNER:
-            return "INNER " + postfix
-        elif self.type == _SqlJoinType.LEFT:
-            return "LEFT OUTER " + postfix
-        elif self.type == _SqlJoinType.RIGHT:
-            return "RIGHT OUTER " + postfix
-        elif self.type == _SqlJoinType.FULL:
-            return "FULL OUTER " + postfix
-        else:
+        out = []
+        self._render(query, out)
+        return "".join(out)
+
+    def _render(self, query, out):
+        prefix = _SqlJoin._prefixes.get(self.type)
+        if prefix is None:
             raise SqlException("Unknown Join type")
+        out.append(prefix)
+        self.other_table._render(query, out, True)
+        out.append(" ON ")
+        _emit_node(query, self.condition, out)
+
+    def _compute_key(self, key):
+        return "J", self.type, key(self.other_table), key(self.condition)
 
+    def _children(self):
+        return self.other_table, self.condition
+
+
+class _SqlWhereStatement(_SqlNode):
+    __slots__ = ()
 
-class _SqlWhereStatement:
     def between(self, v1, v2):
         return _SqlWhereCondition(self, (v1, v2), _SqlWhereConditionType.BETWEEN)
 
@@ -125,6 +322,8 @@ class _SqlWhereStatement:
         return _SqlWhereCondition(self, s, _SqlWhereConditionType.LIKE)
 
     def in_(self, l):
+        if not isinstance(l, (SqlQuery, _SqlTable)):
+            l = tuple(l)  # Lists (copied, as the structure key is cached), sets, generators, ...
         return _SqlWhereCondition(self, l, _SqlWhereConditionType.IN)
 
     def __invert__(self):
@@ -149,73 +348,227 @@ class _SqlWhereStatement:
         return _SqlWhereCondition(self, other, _SqlWhereConditionType.GEQ)
 
     def __and__(self, other):
-        return _SqlWhereCondition(self, other, _SqlWhereConditionType.AND)
+        return _junction(self, other, _SqlWhereConditionType.AND)
 
     def __or__(self, other):
-        return _SqlWhereCondition(self, other, _SqlWhereConditionType.OR)
+        return _junction(self, other, _SqlWhereConditionType.OR)
+
+
+# AND/OR conditions are n-ary: _op1 is a list of operands of which the first _op2 entries belong to the node.
+# Chaining appends to the list of the left operand if no other node did so before, so chains are built in linear
+# time while existing nodes never change. Otherwise the operands are copied
+_junction_lock = threading.Lock()
+
+
+def _junction(left, right, type):
+    if right.__class__ is _SqlWhereCondition and right._type == type:
+        right_ops = right._op1[:right._op2]
+    else:
+        right_ops = [right]
+
+    if left.__class__ is _SqlWhereCondition and left._type == type:
+        ops, n = left._op1, left._op2
+        with _junction_lock:
+            shared = len(ops) == n
+            if shared:
+                ops.extend(right_ops)
+        if not shared:  # Tail taken by another node
+            ops = ops[:n] + right_ops
+    else:
+        ops, n = [left] + right_ops, 1
+    return _SqlWhereCondition(ops, n + len(right_ops), type)
+
+
+# Conditions are rendered without recursion: Expanders push the parts of a condition in reverse order onto a
+# stack, which holds raw SQL fragments (str), nested conditions and operands to emit (wrapped in a tuple)
+def _operand(obj):
+    return obj if obj.__class__ is _SqlWhereCondition else (obj,)
+
+
+def _condition_expander(operator):
+    def expand(query, cond, stack):
+        stack.extend((")", _operand(cond._op2), operator, _operand(cond._op1), "("))
+
+    return expand
+
+
+def _expand_between(query, cond, stack):
+    stack.extend((")", (cond._op2[1],), " AND ", (cond._op2[0],), " BETWEEN ", _operand(cond._op1), "("))
+
+
+_json_types = tuple(set(six.string_types + six.integer_types + (float, bool, type(None))))
+
+
+# Large literal lists are passed as one JSON array, read through json_each, instead of one value each
+# noinspection PyProtectedMember
+def _json_list(query, values):
+    threshold = query._in_list_threshold
+    if threshold is None or len(values) <= threshold:
+        return None
+    for v in values:
+        if not isinstance(v, _json_types):
+            return None
+    try:
+        array = json.dumps(values, separators=(",", ":"), allow_nan=False)
+    except ValueError:
+        return None
+
+    if query._params is not None:
+        return "(SELECT value FROM json_each(%s))" % _bind(query, array)
+    else:
+        return "(SELECT value FROM json_each('%s'))" % _escape_str(array)
+
+
+def _expand_in(query, cond, stack):
+    op2 = cond._op2
+    if isinstance(op2, SqlQuery) or isinstance(op2, _SqlTable):
+        stack.extend((")", (op2,), " IN ", _operand(cond._op1), "("))
+        return
+
+    # Parameters are bound in order of appearance, so the left operand is rendered first
+    out = []
+    _emit(query, cond._op1, out)
+    source = _json_list(query, op2)
+    if source is not None:
+        stack.extend((")", source, " IN ", "".join(out), "("))
+    else:
+        stack.append("))")
+        for i, e in enumerate(reversed(op2)):
+            if i:
+                stack.append(", ")
+            stack.append((e,))
+        stack.extend((" IN (", "".join(out), "("))
+
+
+def _expand_exists(query, cond, stack):
+    stack.extend((")", _operand(cond._op1), "(EXISTS "))
+
+
+def _expand_not(query, cond, stack):
+    stack.extend((")", _operand(cond._op1), "(NOT "))
+
+
+def _junction_expander(operator):
+    def expand(query, cond, stack):
+        stack.append(")")
+        for i in range(cond._op2 - 1, -1, -1):
+            stack.append(_operand(cond._op1[i]))
+            if i:
+                stack.append(operator)
+        stack.append("(")
+
+    return expand
+
+
+_condition_expanders = {
+    _SqlWhereConditionType.EQ: _condition_expander(" = "),
+    _SqlWhereConditionType.NEQ: _condition_expander(" <> "),
+    _SqlWhereConditionType.GREATER: _condition_expander(" > "),
+    _SqlWhereConditionType.LESS: _condition_expander(" < "),
+    _SqlWhereConditionType.GEQ: _condition_expander(" >= "),
+    _SqlWhereConditionType.LEQ: _condition_expander(" <= "),
+    _SqlWhereConditionType.LIKE: _condition_expander(" LIKE "),
+    _SqlWhereConditionType.BETWEEN: _expand_between,
+    _SqlWhereConditionType.IN: _expand_in,
+    _SqlWhereConditionType.EXISTS: _expand_exists,
+    _SqlWhereConditionType.AND: _junction_expander(" AND "),
+    _SqlWhereConditionType.OR: _junction_expander(" OR "),
+    _SqlWhereConditionType.NOT: _expand_not,
+}
+
+
+def _render_condition(query, cond, out):
+    stack = [cond]
+    while stack:
+        item = stack.pop()
+        if item.__class__ is str:
+            out.append(item)
+        elif item.__class__ is _SqlWhereCondition:
+            expand = _condition_expanders.get(item._type)
+            if expand is None:
+                raise SqlException("Unknown where condition type: %s" % str(item._type))
+            expand(query, item, stack)
+        else:
+            _emit(query, item[0], out)
 
 
 class _SqlWhereCondition(_SqlWhereStatement):
+    __slots__ = ("_op1", "_op2", "_type")
+
     def __init__(self, op1, op2, type):
         self._op1 = op1
         self._op2 = op2
         self._type = type
 
     def build(self, query):
-        if self._type == _SqlWhereConditionType.EQ:
-            return "(%s = %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.NEQ:
-            return "(%s <> %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.GREATER:
-            return "(%s > %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.LESS:
-            return "(%s < %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.GEQ:
-            return "(%s >= %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.LEQ:
-            return "(%s <= %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.LIKE:
-            return "(%s LIKE %s)" % (_escape(query, self._op1), _escape(query, self._op2))
+        out = []
+        self._render(query, out)
+        return "".join(out)
+
+    def _render(self, query, out):
+        _render_condition(query, self, out)
+
+    def _is_junction(self):
+        return self._type == _SqlWhereConditionType.AND or self._type == _SqlWhereConditionType.OR
+
+    def _operands(self):
+        if self._is_junction():
+            return self._op1[:self._op2]
         elif self._type == _SqlWhereConditionType.BETWEEN:
-            return "(%s BETWEEN %s AND %s)" % (
-                _escape(query, self._op1), _escape(query, self._op2[0]), _escape(query, self._op2[1]))
-        elif self._type == _SqlWhereConditionType.IN:
-            if isinstance(self._op2, SqlQuery) or isinstance(self._op2, _SqlTable):
-                return "(%s IN %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-            else:
-                return "(%s IN (%s))" % (_escape(query, self._op1), ', '.join(_escape(query, e) for e in self._op2))
-        elif self._type == _SqlWhereConditionType.EXISTS:
-            return "(EXISTS %s)" % (_escape(query, self._op1))
-        elif self._type == _SqlWhereConditionType.AND:
-            return "(%s AND %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.OR:
-            return "(%s OR %s)" % (_escape(query, self._op1), _escape(query, self._op2))
-        elif self._type == _SqlWhereConditionType.NOT:
-            return "(NOT %s)" % (_escape(query, self._op1))
+            return [self._op1, self._op2[0], self._op2[1]]
+        elif self._type == _SqlWhereConditionType.IN and isinstance(self._op2, (list, tuple)):
+            return [self._op1] + list(self._op2)
+        elif self._type == _SqlWhereConditionType.EXISTS or self._type == _SqlWhereConditionType.NOT:
+            return [self._op1]
         else:
-            raise SqlException("Unknown where condition type: %s" % str(self._type))
+            return [self._op1, self._op2]
+
+    def _compute_key(self, key):
+        if self._is_junction():
+            return "W", self._type, key(self._op1[:self._op2])
+        return "W", self._type, key(self._op1), key(self._op2)
+
+    def _children(self):
+        return self._operands()
 
 
 class SqlFunction(_SqlWhereStatement):
+    __slots__ = ("_op", "_type")
+
     def __init__(self, op, type):
         self._op = op
         self._type = type
 
+    _names = {
+        _SqlFunctionType.MAX: "MAX(",
+        _SqlFunctionType.MIN: "MIN(",
+        _SqlFunctionType.AVG: "AVG(",
+        _SqlFunctionType.COUNT: "COUNT(",
+        _SqlFunctionType.SUM: "SUM(",
+    }
+
     def build(self, query):
-        if self._type == _SqlFunctionType.MAX:
-            return "MAX(%s)" % _escape(query, self._op)
-        elif self._type == _SqlFunctionType.MIN:
-            return "MIN(%s)" % _escape(query, self._op)
-        elif self._type == _SqlFunctionType.AVG:
-            return "AVG(%s)" % _escape(query, self._op)
-        elif self._type == _SqlFunctionType.COUNT:
-            return "COUNT(%s)" % _escape(query, self._op)
-        elif self._type == _SqlFunctionType.SUM:
-            return "SUM(%s)" % _escape(query, self._op)
-        elif self._type == _SqlFunctionType.DEFAULT:
-            return "DEFAULT"
-        else:
+        out = []
+        self._render(query, out)
+        return "".join(out)
+
+    def _render(self, query, out):
+        if self._type == _SqlFunctionType.DEFAULT:
+            out.append("DEFAULT")
+            return
+
+        name = SqlFunction._names.get(self._type)
+        if name is None:
             raise SqlException("Unknown function type: %s" % str(self._type))
+        out.append(name)
+        _emit(query, self._op, out)
+        out.append(")")
+
+    def _compute_key(self, key):
+        return "F", self._type, key(self._op)
+
+    def _children(self):
+        return self._op,
 
     @staticmethod
     def max(op):
@@ -242,77 +595,331 @@ class SqlFunction(_SqlWhereStatement):
         return SqlFunction(None, _SqlFunctionType.DEFAULT)
 
 
+# Tables and columns are immutable, as_() and set() return new nodes.
+# Nodes without value are interned, so 'D.book.title' always returns the same object
 class _SqlColumn(_SqlWhereStatement):
-    def __init__(self, table, column):
+    __slots__ = ("table", "column", "alias", "value")
+
+    def __init__(self, table, column, alias=None, value=None):
         self.table = table
         self.column = column
-        self.alias = None
-        self.value = None
+        self.alias = alias
+        self.value = value
 
     def build(self, query, with_as=False):
+        out = []
+        self._render(query, out, with_as)
+        return "".join(out)
+
+    def _render(self, query, out, with_as=False):
         if with_as and self.alias:
-            return "%s.%s AS %s" % (
-            _escape(query, self.table), _enquote(query, self.column), _enquote(query, self.alias))
+            out.append("%s.%s AS %s" % (
+                _table_ref(query, self.table), _enquote(query, self.column), _enquote(query, self.alias)))
         else:
-            return "%s.%s" % (_escape(query, self.table), _enquote(query, self.column))
+            out.append(_table_ref(query, self.table) + "." + _enquote(query, self.column))
 
     def build_value(self, query):
+        out = []
+        self._render_value(query, out)
+        return "".join(out)
+
+    def _render_value(self, query, out):
         if self.value is None:
             if not query._ignore_none:
                 raise SqlException("None value given")
             else:
-                return "NULL"
+                out.append("NULL")
         else:
-            return _escape(query, self.value)
+            _emit(query, self.value, out)
 
     def as_(self, alias):
-        self.alias = alias
-        return self
+        if self.value is not None:
+            return _SqlColumn(self.table, self.column, alias, self.value)
+        return self.table._column(self.column, alias)
+
+    def _compute_key(self, key):
+        return "C", key(self.table), self.column, self.alias, key(self.value)
+
+    def _children(self):
+        return self.table, self.value
 
     def set(self, value):
-        self.value = value
-        return self
+        return _SqlColumn(self.table, self.column, self.alias, value)
 
 
-class _SqlTable:
-    def __init__(self, name):
+class _SqlTable(_SqlNode):
+    __slots__ = ("_name", "_alias", "_column_nodes")
+
+    _nodes = {}
+
+    def __init__(self, name, alias=None):
         self._name = name
-        self._alias = None
+        self._alias = alias
+        self._column_nodes = {}
+        self._key = self._shape = ("T", name, alias)  # Set eagerly, unset slots would resolve to columns
+
+    @staticmethod
+    def _intern(name, alias=None):
+        key = (name, alias)
+        table = _SqlTable._nodes.get(key)
+        if table is None:
+            table = _SqlTable._nodes.setdefault(key, _SqlTable(name, alias))
+        return table
+
+    def _column(self, column, alias=None):
+        key = (column, alias)
+        c = self._column_nodes.get(key)
+        if c is None:
+            c = self._column_nodes.setdefault(key, _SqlColumn(self, column, alias))
+        return c
 
     def build(self, query, with_as=False):
+        out = []
+        self._render(query, out, with_as)
+        return "".join(out)
+
+    def _render(self, query, out, with_as=False):
         if with_as and self._alias:
-            return "%s AS %s" % (_enquote(query, self._name), _enquote(query, self._alias))
+            out.append("%s AS %s" % (_enquote(query, self._name), _enquote(query, self._alias)))
         else:
-            return "%s" % _enquote(query, self._name)
+            out.append(_enquote(query, self._name))
 
     def as_(self, alias):
-        self._alias = alias
-        return self
+        return _SqlTable._intern(self._name, alias)
 
     def __getattr__(self, item):
-        return _SqlColumn(self, item)
+        if item.startswith("__"):  # Keep protocol lookups (copy, pickle, ...) working
+            raise AttributeError(item)
+        return self._column(item)
+
+
+# Row value '(a, b, ...)', compared lexicographically by SQLite
+class _SqlRowValue(_SqlWhereStatement):
+    __slots__ = ("_items",)
+
+    def __init__(self, items):
+        self._items = tuple(items)
+
+    def build(self, query):
+        out = []
+        self._render(query, out)
+        return "".join(out)
+
+    def _render(self, query, out):
+        out.append("(")
+        for i, e in enumerate(self._items):
+            if i:
+                out.append(", ")
+            _emit(query, e, out)
+        out.append(")")
+
+    def _compute_key(self, key):
+        return "R", key(self._items)
+
+    def _children(self):
+        return self._items
+
+
+class _SqlParameter(_SqlNode):
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def build(self, query):
+        if query._params is not None:
+            query._params.append(self)
+            return "?"
+        else:
+            return ":%s" % self.name
+
+    def _render(self, query, out):
+        out.append(self.build(query))
+
+    def _compute_key(self, key):
+        return "P", self.name
+
+
+class _SqlIndexOptions(object):
+    __slots__ = ("name", "unique", "if_not_exists", "covering")
+
+    def __init__(self):
+        self.name = None
+        self.unique = False
+        self.if_not_exists = False
+        self.covering = ()
+
+    def _structure_key(self, literals=True):
+        return "I", self.name, self.unique, self.if_not_exists, _structure_key(self.covering, literals)
+
+
+# Position of a column in a select list, preferring the same table alias
+# noinspection PyProtectedMember
+def _column_index(columns, column):
+    found = None
+    for i, e in enumerate(columns):
+        if isinstance(e, _SqlColumn) and e.table._name == column.table._name and e.column == column.column:
+            if e.table._alias == column.table._alias:
+                return i
+            elif found is None:
+                found = i
+    return found
+
+
+# Implicit columns of every rowid table
+_ROWID_NAMES = ("rowid", "oid", "_rowid_")
+
+
+# Column to append to orderby() columns of a table (lowercase names) to identify its rows, None if they do
+def _tiebreaker(info, columns):
+    if info is None:  # Unknown to the schema
+        return None if columns.intersection(_ROWID_NAMES) else "rowid"
+    rowid = info.rowid_column
+    if columns.intersection(_ROWID_NAMES) or (rowid is not None and rowid.name.lower() in columns):
+        return None
+    for index in info.indexes:
+        if index.unique and not index.partial and None not in index.columns and \
+                set(c.lower() for c in index.columns) <= columns and all(info.column(c).notnull for c in index.columns):
+            return None
+    if info.view:
+        raise SqlException("Orderby of paginate needs to identify the rows of view '%s'" % info.name)
+    return rowid.name if rowid is not None else "rowid"
+
+
+def _check_params(params):
+    for p in params:
+        if isinstance(p, _SqlParameter):
+            raise SqlException("Parameter '%s' needs to be bound through compile()" % p.name)
+
+
+class SqlTemplate:
+    # tables: Names of all tables of the query, written: Names of the tables modified by it
+    def __init__(self, sql, params, tables=(), written=()):
+        self.sql = sql
+        self.tables = frozenset(tables)
+        self.written = frozenset(written)
+        self._values = list(params)
+        self._slots = [(i, p.name) for i, p in enumerate(params) if isinstance(p, _SqlParameter)]
+
+    @property
+    def names(self):
+        return [name for _, name in self._slots]
+
+    def bind(self, *args, **kwargs):
+        values = dict(*args, **kwargs)
+        params = list(self._values)
+        for i, name in self._slots:
+            if name not in values:
+                raise SqlException("No value given for parameter '%s'" % name)
+            params[i] = values[name]
+        return tuple(params)
+
+
+class _SqlTemplateCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            template = self._entries.pop(key, None)
+            if template is not None:
+                self._entries[key] = template
+            return template
+
+    def put(self, key, template):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = template
+            while len(self._entries) > SqlQuery.TEMPLATE_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Names (lower case) of all tables a query reads or writes, including subqueries and unions
+# noinspection PyProtectedMember
+def _query_tables(query):
+    tables = set()
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, SqlQuery):
+            stack.extend(node._tables)
+            stack.extend(j.other_table for j in node._joins)
+            stack.extend(j.condition for j in node._joins)
+            stack.extend(node._columns)
+            stack.extend(node._wheres)
+            stack.extend(node._havings)
+            if node._seek is not None:
+                stack.append(node._seek)
+            stack.extend(q for _, q in node._unions)
+        elif isinstance(node, _SqlTable):
+            tables.add(node._name.lower())
+        elif isinstance(node, _SqlColumn):
+            stack.append(node.value)
+        elif isinstance(node, _SqlWhereCondition):
+            stack.extend(node._operands())
+            if isinstance(node._op2, (SqlQuery, _SqlTable)):
+                stack.append(node._op2)
+        elif isinstance(node, SqlFunction):
+            stack.append(node._op)
+        elif isinstance(node, _SqlRowValue):
+            stack.extend(node._items)
+    return tables
+
+
+# (sql, params) of a query, a compiled template or a plain SQL string
+def _statement(query, params=None):
+    if isinstance(query, SqlQuery):
+        if params:
+            template = query.compile()
+            return template.sql, template.bind(params)
+        return query.build_params()
+    elif isinstance(query, SqlTemplate):
+        return query.sql, query.bind(params or {})
+    else:
+        return query, params or ()
 
 
 class _SqlDatabase(type):
     def __getattr__(self, item):
-        return _SqlTable(item)
+        return _SqlTable._intern(item)
 
 
 class SqlDatabase(with_metaclass(_SqlDatabase)):
     pass
 
 
-class SqlQuery:
+class SqlQuery(object):
     # Some default values
     IGNORE_NONE = False
     USE_QUOTES = True
     USE_ALIASES = True
+    TEMPLATE_CACHE_SIZE = 256
+    # SQLite limits (SQLITE_MAX_VARIABLE_NUMBER, SQLITE_MAX_SQL_LENGTH) respected by bulk statements
+    MAX_VARIABLES = 999
+    MAX_SQL_LENGTH = 1000000
+    # Literal IN lists longer than this are bound as a single JSON array (needs JSON1). None disables it
+    IN_LIST_THRESHOLD = None
+    # Builder methods return new queries instead of modifying them, see immutable()
+    IMMUTABLE = False
+
+    _template_cache = _SqlTemplateCache()
 
     # TODO: Multiple equal columns??
     def __init__(self, operation):
         self._operation = operation
         self._tables = []
         self._columns = []
+        self._table_aliases = {}
+        self._join_aliases = {}
+        self._column_aliases = {}
         self._wheres = []
         self._havings = []
         self._orderby_table = {}
@@ -320,7 +927,12 @@ class SqlQuery:
         self._joins = []
         self._last_column = None
         self._last_orderby = None
-        self._union = None
+        self._unions = []  # (all, query)
+        self._seek = None
+        self._conflict = None
+        self._match = None
+        self._index = None
+        self._params = None
 
         self._select_distinct = False
         self._limit = 0
@@ -329,6 +941,13 @@ class SqlQuery:
         self._ignore_none = SqlQuery.IGNORE_NONE
         self._use_quotes = SqlQuery.USE_QUOTES
         self._use_aliases = SqlQuery.USE_ALIASES
+        self._in_list_threshold = SqlQuery.IN_LIST_THRESHOLD
+        self._immutable = SqlQuery.IMMUTABLE
+
+    # Clause lists and dicts, shared between immutable queries
+    _containers = ("_tables", "_columns", "_table_aliases", "_join_aliases", "_column_aliases", "_wheres",
+                   "_havings", "_orderby_table", "_groupby_list", "_joins", "_unions", "_conflict", "_match",
+                   "_index")
 
     # First step: Operator
     @staticmethod
@@ -347,59 +966,186 @@ class SqlQuery:
     def delete(*tables):
         return SqlQuery.__start_operation(tables, _SqlOperationType.DELETE)
 
+    # Insert updating the existing row on a conflict of the conflict() columns
+    @staticmethod
+    def upsert(*tables):
+        query = SqlQuery.__start_operation(tables, _SqlOperationType.INSERT)
+        query._conflict = []
+        return query
+
+    # CREATE INDEX on the given columns of one table. Partial with where(), covering with covering()
+    @staticmethod
+    def create_index(*columns):
+        if not columns:
+            raise SqlException("No index columns given")
+        # noinspection PyProtectedMember
+        if any(c.table._name != columns[0].table._name for c in columns):
+            raise SqlException("Index columns need to be of one table")
+
+        query = SqlQuery.__start_operation([columns[0].table], _SqlOperationType.CREATE_INDEX)
+        query._index = _SqlIndexOptions()
+        return query.columns(*columns)
+
+    # Placeholder for a value bound when executing a compiled query
+    @staticmethod
+    def param(name):
+        return _SqlParameter(name)
+
+    @staticmethod
+    def clear_template_cache():
+        SqlQuery._template_cache.clear()
+
     @staticmethod
     def __start_operation(tables, operation):
         query = SqlQuery(operation)
-        query._tables.extend(tables)
+        return query.tables(*tables)
+
+    # Immutable mode: Builder methods return a new query, sharing the unchanged clauses with this one, so a
+    # base query can be reused (also across threads) to derive variants. Returns an immutable copy
+    def immutable(self, b=True):
+        query = self._shallow_copy()
+        for name in SqlQuery._containers:
+            container = getattr(query, name)
+            if container is not None:
+                setattr(query, name, copy.copy(container))
+        query._immutable = b
         return query
 
+    def _shallow_copy(self):
+        query = SqlQuery.__new__(SqlQuery)
+        query.__dict__ = self.__dict__.copy()
+        return query
+
+    # The query to modify: this one, or a copy in immutable mode
+    def _derive(self):
+        return self._shallow_copy() if self._immutable else self
+
+    # Clause list or dict to modify in place: A copy in immutable mode, as it is shared with the parent query
+    def _own(self, container):
+        return copy.copy(container) if self._immutable else container
+
     # Flags
     def distinct(self):
         if self._operation != _SqlOperationType.SELECT:
             raise SqlException("Need Select operator for distinct")
 
-        self._select_distinct = True
-        return self
+        query = self._derive()
+        query._select_distinct = True
+        return query
 
     def limit(self, count):
-        self._limit = count
-        return self
+        query = self._derive()
+        query._limit = count
+        return query
 
     def offset(self, count):
-        self._offset = count
-        return self
+        query = self._derive()
+        query._offset = count
+        return query
 
     def ignore_none(self, b=True):
-        self._ignore_none = b
-        return self
+        query = self._derive()
+        query._ignore_none = b
+        return query
 
     def use_quotes(self, b=True):
-        self._use_quotes = b
-        return self
+        query = self._derive()
+        query._use_quotes = b
+        return query
 
     def use_aliases(self, b=True):
-        self._use_aliases = b
-        return self
+        query = self._derive()
+        query._use_aliases = b
+        return query
+
+    def in_list_threshold(self, count):
+        query = self._derive()
+        query._in_list_threshold = count
+        return query
 
     # (Optional)
     def tables(self, *l):
-        self._tables.extend(l)
-        return self
+        query = self._derive()
+        query._tables = query._own(query._tables)
+        query._table_aliases = query._own(query._table_aliases)
+        query._tables.extend(l)
+        for t in l:
+            query._table_aliases.setdefault(t._name, t._alias)
+        return query
 
     # Columns
     def columns(self, *l):
-        self._columns.extend(l)
-        return self
+        query = self._derive()
+        query._columns = query._own(query._columns)
+        query._column_aliases = query._own(query._column_aliases)
+        query._columns.extend(l)
+        for c in l:
+            query._column_aliases.setdefault((c.table._name, c.column), c.alias)
+        return query
+
+    # Upsert: ON CONFLICT target, the other columns are updated with the inserted values
+    def conflict(self, *columns):
+        if self._operation != _SqlOperationType.INSERT:
+            raise SqlException("Need Insert operator for conflict")
+
+        query = self._derive()
+        query._conflict = query._own(query._conflict) if query._conflict is not None else []
+        query._conflict.extend(columns)
+        return query
+
+    # Index options
+    def __index_options(self, what):
+        if self._operation != _SqlOperationType.CREATE_INDEX:
+            raise SqlException("Need Create Index operator for %s" % what)
+
+        query = self._derive()
+        query._index = query._own(query._index)
+        return query
+
+    def name(self, name):
+        query = self.__index_options("name")
+        query._index.name = name
+        return query
+
+    def unique(self, b=True):
+        query = self.__index_options("unique")
+        query._index.unique = b
+        return query
+
+    def if_not_exists(self, b=True):
+        query = self.__index_options("if_not_exists")
+        query._index.if_not_exists = b
+        return query
+
+    # Columns appended to the key columns, so queries reading only indexed columns never touch the table
+    def covering(self, *columns):
+        query = self.__index_options("covering")
+        query._index.covering = query._index.covering + columns
+        return query
+
+    # Batched update: Columns identifying the rows updated by rows(), the other columns are set
+    def match(self, *columns):
+        if self._operation != _SqlOperationType.UPDATE:
+            raise SqlException("Need Update operator for match")
+
+        query = self._derive()
+        query._match = query._own(query._match) if query._match is not None else []
+        query._match.extend(columns)
+        return query
 
     # Where
     def where(self, *condition):
-        self._wheres.extend(condition)
-        return self
+        query = self._derive()
+        query._wheres = query._own(query._wheres)
+        query._wheres.extend(condition)
+        return query
 
     # Having
     def having(self, *condition):
-        self._havings.extend(condition)
-        return self
+        query = self._derive()
+        query._havings = query._own(query._havings)
+        query._havings.extend(condition)
+        return query
 
     # Order By
     # TODO: Position of queue element important?
@@ -407,10 +1153,12 @@ class SqlQuery:
         if self._operation != _SqlOperationType.SELECT:
             raise SqlException("Need Select operator for orderby")
 
+        query = self._derive()
+        query._orderby_table = query._own(query._orderby_table)
         for c in columns:
-            self._orderby_table[str(c)] = (_SqlOrderByType.ASC, c)
-            self._last_orderby = c
-        return self
+            query._orderby_table[str(c)] = (_SqlOrderByType.ASC, c)
+            query._last_orderby = c
+        return query
 
     def asc(self):
         if self._operation != _SqlOperationType.SELECT:
@@ -418,8 +1166,10 @@ class SqlQuery:
         if self._last_orderby is None:
             raise SqlException("No previous orderby")
 
-        self._orderby_table[str(self._last_orderby)] = (_SqlOrderByType.ASC, self._last_orderby)
-        return self
+        query = self._derive()
+        query._orderby_table = query._own(query._orderby_table)
+        query._orderby_table[str(query._last_orderby)] = (_SqlOrderByType.ASC, query._last_orderby)
+        return query
 
     def desc(self):
         if self._operation != _SqlOperationType.SELECT:
@@ -427,24 +1177,32 @@ class SqlQuery:
         if self._last_orderby is None:
             raise SqlException("No previous orderby")
 
-        self._orderby_table[str(self._last_orderby)] = (_SqlOrderByType.DESC, self._last_orderby)
-        return self
+        query = self._derive()
+        query._orderby_table = query._own(query._orderby_table)
+        query._orderby_table[str(query._last_orderby)] = (_SqlOrderByType.DESC, query._last_orderby)
+        return query
 
     # Group By
     def groupby(self, *columns):
         if self._operation != _SqlOperationType.SELECT:
             raise SqlException("Need Select operator for groupby")
 
-        self._groupby_list.extend(columns)
-        return self
+        query = self._derive()
+        query._groupby_list = query._own(query._groupby_list)
+        query._groupby_list.extend(columns)
+        return query
 
     # Joins
     def __add_join(self, table2, condition, type):
         if self._operation != _SqlOperationType.SELECT:
             raise SqlException("Need Select operator for joins")
 
-        self._joins.append(_SqlJoin(table2, condition, type))
-        return self
+        query = self._derive()
+        query._joins = query._own(query._joins)
+        query._join_aliases = query._own(query._join_aliases)
+        query._joins.append(_SqlJoin(table2, condition, type))
+        query._join_aliases.setdefault(table2._name, table2._alias)
+        return query
 
     def join(self, table2, condition):
         return self.__add_join(table2, condition, _SqlJoinType.INNER)
@@ -458,18 +1216,132 @@ class SqlQuery:
     def full_join(self, table2, condition):
         return self.__add_join(table2, condition, _SqlJoinType.FULL)
 
-    # Union
-    def union(self, other_query):
+    # Keyset pagination: Restricts the result to the rows following the given one in orderby() order.
+    # row is either a tuple of the orderby values, or a result row (mapping or named row) containing them.
+    # Rows tied with it on all orderby columns are skipped, see paginate() for making the order unique
+    def seek_after(self, row):
+        if self._operation != _SqlOperationType.SELECT:
+            raise SqlException("Need Select operator for seek_after")
+        if not self._orderby_table:
+            raise SqlException("Need orderby for seek_after")
+
+        orderby = list(self._orderby_table.values())
+        values = self._seek_values(row, [c for _, c in orderby])
+        types = set(t for t, _ in orderby)
+        query = self._derive()
+        if len(types) == 1:
+            columns = [c for _, c in orderby]
+            if len(columns) == 1:
+                left, right = columns[0], values[0]
+            else:
+                left, right = _SqlRowValue(columns), _SqlRowValue(values)
+            query._seek = left > right if _SqlOrderByType.ASC in types else left < right
+        else:  # Mixed directions: (a > ?) OR (a = ? AND b < ?) OR ...
+            terms = []
+            for i, (t, c) in enumerate(orderby):
+                term = c > values[i] if t == _SqlOrderByType.ASC else c < values[i]
+                for j in reversed(range(i)):
+                    term = (orderby[j][1] == values[j]) & term
+                terms.append(term)
+            query._seek = terms[0]
+            for term in terms[1:]:
+                query._seek = query._seek | term
+        return query
+
+    # noinspection PyProtectedMember
+    def _seek_values(self, row, columns):
+        if hasattr(row, "_fields") and self._columns:  # Result row: By position, as names may repeat
+            values = []
+            for c in columns:
+                index = _column_index(self._columns, c)
+                if index is None:
+                    raise SqlException("Orderby column '%s.%s' not in the result" % (c.table._name, c.column))
+                values.append(row[index])
+            return values
+        elif hasattr(row, "keys") or hasattr(row, "_fields"):
+            names = [self._column_aliases.get((c.table._name, c.column)) or c.column for c in columns]
+            if hasattr(row, "keys"):
+                return [row[name] for name in names]
+            return [getattr(row, name) for name in names]
+
+        if len(row) != len(columns):
+            raise SqlException("Expected %i orderby values, got %i" % (len(columns), len(row)))
+        return list(row)
+
+    # Iterates over the result in pages of page_size rows, each fetched with a keyset condition.
+    # Keysets need an orderby() identifying the rows: For each table whose rowid or not null unique index isn't
+    # part of it (by the reflected schema of the engine), the rowid is appended. All orderby columns need to be
+    # part of the result
+    def paginate(self, engine, page_size, params=None):
+        if self._offset > 0:
+            raise SqlException("Offset can not be combined with paginate")
+        if not self._orderby_table:
+            raise SqlException("Need orderby for paginate")
+
+        query = self._unique_order(engine.schema())
+        query._limit = page_size
+        while True:
+            page = list(engine.stream(query, params))
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            query = copy.copy(query).seek_after(page[-1])
+
+    # noinspection PyProtectedMember
+    def _unique_order(self, schema):
+        query = copy.copy(self)
+        query._orderby_table = dict(self._orderby_table)
+        ordered = [c for _, c in self._orderby_table.values()]
+        for c in ordered:
+            if not isinstance(c, _SqlColumn):
+                raise SqlException("Orderby of paginate needs columns")
+
+        infos = {}
+        for table in self._tables + [j.other_table for j in self._joins]:
+            try:
+                info = infos[table._name] = schema.table_info(table._name)
+            except SqlException:
+                info = None
+            columns = set(c.column.lower() for c in ordered
+                          if c.table._name == table._name and c.table._alias == table._alias)
+            tiebreaker = _tiebreaker(info, columns)
+            if tiebreaker is not None:
+                c = table._column(tiebreaker)
+                query._orderby_table[str(c)] = (_SqlOrderByType.ASC, c)
+
+        for _, c in query._orderby_table.values():
+            if query._columns:
+                selected = _column_index(query._columns, c) is not None
+            else:  # Columns of 'SELECT *', which leaves out the rowid unless it has an INTEGER PRIMARY KEY alias
+                info = infos.get(c.table._name)
+                selected = info.column(c.column) is not None if info is not None else \
+                    c.column.lower() not in _ROWID_NAMES
+            if not selected:
+                raise SqlException("Orderby column '%s.%s' needs to be selected for paginate" % (
+                    c.table._name, c.column))
+        return query
+
+    # Union, chained in call order: q.union(a).union_all(b, c)
+    def union(self, *other_queries):
+        return self.__add_unions(other_queries, False)
+
+    # UNION ALL keeps duplicates, avoiding the temporary B-tree used to remove them
+    def union_all(self, *other_queries):
+        return self.__add_unions(other_queries, True)
+
+    # noinspection PyProtectedMember
+    def __add_unions(self, other_queries, all):
         if self._operation != _SqlOperationType.SELECT:
             raise SqlException("Need Select operator for unions")
-        # noinspection PyProtectedMember
-        if other_query._operation != _SqlOperationType.SELECT:
-            raise SqlException("Other query needs to be of Select type")
-        if self._union is not None:
-            raise SqlException("Union partner already set")
+        for q in other_queries:
+            if q._operation != _SqlOperationType.SELECT:
+                raise SqlException("Other query needs to be of Select type")
 
-        self._union = other_query
-        return self
+        query = self._derive()
+        query._unions = query._own(query._unions)
+        query._unions.extend((all, q) for q in other_queries)
+        return query
 
     def __add__(self, other):
         return self.union(other)
@@ -478,136 +1350,425 @@ class SqlQuery:
     # noinspection PyProtectedMember
     def get_alias_for_table(self, table):
         if self._use_aliases:
-            for ot in self._tables:
-                if ot._name == table._name:
-                    return ot._alias
-            for j in self._joins:
-                if j.other_table._name == table._name:
-                    return j.other_table._alias
+            if table._name in self._table_aliases:
+                return self._table_aliases[table._name]
+            return self._join_aliases.get(table._name)
         return None
 
     # noinspection PyProtectedMember
     def get_alias_for_column(self, c):
         if self._use_aliases:
-            for oc in self._columns:
-                if oc.table._name == c.table._name and oc.column == c.column:
-                    return oc.alias
+            return self._column_aliases.get((c.table._name, c.column))
         return None
 
-    def _build_select_columns(self):
+    def _render_list(self, out, items, sep, render):
+        it = iter(items)
+        render(self, next(it), out)
+        for e in it:
+            out.append(sep)
+            render(self, e, out)
+
+    def _render_select_columns(self, out):
         if len(self._columns) == 0:
-            return "*"
+            out.append("*")
         else:
-            return ", ".join(e.build(self, True) for e in self._columns)
+            for i, e in enumerate(self._columns):
+                if i:
+                    out.append(", ")
+                e._render(self, out, True)
 
-    def _build_insert_columns(self):
-        return ", ".join(_enquote(self, e.column) for e in self._columns)
+    def _render_insert_columns(self, out):
+        out.append(", ".join(_enquote(self, e.column) for e in self._columns))
 
-    def _build_tables(self):
+    def _render_tables(self, out):
         if not self._tables:
             raise SqlException("No table given")
 
-        q = ", ".join(e.build(self, self._use_aliases) for e in self._tables)
-        return q
-
-    def _build_where(self):
-        return "WHERE " + " AND ".join(cond.build(self) for cond in self._wheres)
+        for i, e in enumerate(self._tables):
+            if i:
+                out.append(", ")
+            e._render(self, out, self._use_aliases)
 
-    def _build_having(self):
-        return "HAVING " + " AND ".join(cond.build(self) for cond in self._havings)
-
-    def _build_groupby(self):
-        return "GROUP BY " + ", ".join(_escape(self, c) for c in self._groupby_list)
-
-    def _build_orderby_entity(self, key_c):
-        if self._orderby_table[key_c][0] == _SqlOrderByType.ASC:
-            return _escape(self, self._orderby_table[key_c][1]) + " ASC"
+    def _render_where(self, out):
+        out.append("WHERE ")
+        if self._seek is None:
+            self._render_list(out, self._wheres, " AND ", _emit_node)
         else:
-            return _escape(self, self._orderby_table[key_c][1]) + " DESC"
-
-    def _build_orderby(self):
-        return "ORDER BY " + ", ".join(self._build_orderby_entity(c) for c in self._orderby_table)
-
-    def _build_joins(self):
-        return " ".join(j.build(self) for j in self._joins)
-
-    def _build_values(self):
-        return "(" + ", ".join(e.build_value(self) for e in self._columns) + ")"
+            self._render_list(out, self._wheres + [self._seek], " AND ", _emit_node)
+
+    def _render_having(self, out):
+        out.append("HAVING ")
+        self._render_list(out, self._havings, " AND ", _emit_node)
+
+    def _render_groupby(self, out):
+        out.append("GROUP BY ")
+        self._render_list(out, self._groupby_list, ", ", _emit)
+
+    def _render_orderby(self, out):
+        out.append("ORDER BY ")
+        for i, (type, c) in enumerate(self._orderby_table.values()):
+            if i:
+                out.append(", ")
+            _emit(self, c, out)
+            out.append(" ASC" if type == _SqlOrderByType.ASC else " DESC")
+
+    def _render_joins(self, out):
+        self._render_list(out, self._joins, " ", _emit_node)
+
+    def _render_values(self, out):
+        out.append("(")
+        self._render_list(out, self._columns, ", ", lambda q, e, o: e._render_value(q, o))
+        out.append(")")
+
+    def _render_set_values(self, out):
+        for i, e in enumerate(self._columns):
+            if i:
+                out.append(", ")
+            out.append(_enquote(self, e.column))
+            out.append(" = ")
+            e._render_value(self, out)
+
+    def _render_conflict(self, out):
+        if not self._conflict:
+            raise SqlException("No conflict columns given")
+
+        out.append("ON CONFLICT (" + ", ".join(_enquote(self, c.column) for c in self._conflict) + ") ")
+        conflict = set(c.column for c in self._conflict)
+        updated = [_enquote(self, c.column) for c in self._columns if c.column not in conflict]
+        if updated:
+            out.append("DO UPDATE SET " + ", ".join("%s = excluded.%s" % (c, c) for c in updated))
+        else:
+            out.append("DO NOTHING")
 
-    def _build_set_values(self):
-        return ", ".join(_enquote(self, e.column) + " = " + e.build_value(self) for e in self._columns)
+    # Shared tail of the SELECT, UPDATE and DELETE statements
+    def _render_limit(self, out, sep):
+        if self._limit > 0:
+            out.append("LIMIT " + str(self._limit) + sep)
+        if self._offset > 0:
+            out.append("OFFSET " + str(self._offset) + sep)
 
     def build(self, beautiful=False, complete=True):
-        if beautiful:
-            sep = "\n"
-        else:
-            sep = " "
-
-        q = ""
+        return self._build(beautiful, complete, None)
+
+    def build_params(self, beautiful=False, complete=True):
+        params = []
+        q = self._build(beautiful, complete, params)
+        _check_params(params)
+        return q, tuple(params)
+
+    # Streams the statement to writer (file, io.StringIO, socket or function) in chunks of about chunk_size
+    # characters, rendering nested queries into the same output. With a params list, literals are appended to it
+    # and replaced by '?' placeholders like build_params()
+    def build_into(self, writer, beautiful=False, complete=True, params=None, chunk_size=65536):
+        out = _SqlChunkWriter(_writer_function(writer), chunk_size)
+        self._render_into(out, beautiful, complete, params)
+        out.flush()
+        if params is not None:
+            _check_params(params)
+
+    # Generator of the statement in chunks of about chunk_size characters, e.g. for writelines() or a chunked HTTP
+    # body. Nested queries and unions are rendered when the generator reaches them, so only the fragments of the
+    # queries in progress are held. The query shouldn't be changed until the end
+    def iter_build(self, beautiful=False, complete=True, chunk_size=65536):
+        chunk, size = [], 0
+        stack = [(self, beautiful, complete)]
+        while stack:
+            item = stack.pop()
+            if item.__class__ is tuple:  # Query to render
+                out = _SqlDeferredOutput()
+                item[0]._render_into(out, item[1], item[2], None)
+                stack.extend(reversed(out))
+                continue
+
+            chunk.append(item)
+            size += len(item)
+            if size >= chunk_size:
+                yield "".join(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield "".join(chunk)
+
+    # Bulk insert (or upsert): Yields (sql, params) for multi-row statements, consuming the rows lazily.
+    # For update queries with match() columns, the rows are joined as 'UPDATE ... FROM (VALUES ...)'
+    def rows(self, iterable, beautiful=False, complete=True):
+        if self._operation == _SqlOperationType.UPDATE:
+            if not self._match:
+                raise SqlException("Need match columns for update rows")
+        elif self._operation != _SqlOperationType.INSERT:
+            raise SqlException("Need Insert or Update operator for rows")
+        if not self._columns:
+            raise SqlException("No columns given")
+        return self._iter_rows(iter(iterable), beautiful, complete)
+
+    def _build_rows_parts(self, beautiful, complete):
+        query = self._render_state(None)
+        query._use_aliases = False  # No aliases allowed
+        return query._render_rows_parts("\n" if beautiful else " ", complete)
+
+    def _render_rows_parts(self, sep, complete):
+        row_sql = "(" + ", ".join("?" * len(self._columns)) + ")"
+        postfix = sep + ";" if complete else sep
+        if self._operation == _SqlOperationType.UPDATE:
+            return self._build_update_rows_parts(sep, row_sql, postfix)
+
+        out = ["INSERT INTO "]
+        self._render_tables(out)
+        out.append(" (")
+        self._render_insert_columns(out)
+        out.append(")" + sep + "VALUES ")
+        if self._conflict is not None:
+            tail = [sep]
+            self._render_conflict(tail)
+            postfix = "".join(tail) + postfix
+        return "".join(out), row_sql, postfix
+
+    # UPDATE t SET c = v.column2 FROM (VALUES (?, ?), ...) AS v WHERE t.id = v.column1
+    def _build_update_rows_parts(self, sep, row_sql, postfix):
+        names = [c.column for c in self._columns]
+        values = _enquote(self, "pearsql_values")
+        refs = dict((name, "%s.%s" % (values, _enquote(self, "column%i" % (i + 1)))) for i, name in enumerate(names))
+        for c in self._match:
+            if c.column not in refs:
+                raise SqlException("Match column '%s' not in columns" % c.column)
+        matched = set(c.column for c in self._match)
+        updated = [name for name in names if name not in matched]
+        if not updated:
+            raise SqlException("No columns to update")
+
+        out = ["UPDATE "]
+        self._render_tables(out)
+        out.append(sep + "SET " + ", ".join("%s = %s" % (_enquote(self, name), refs[name]) for name in updated))
+        out.append(sep + "FROM (VALUES ")
+        tail = [") AS " + values + sep + "WHERE "]
+        for i, c in enumerate(self._match):
+            if i:
+                tail.append(" AND ")
+            c._render(self, tail)
+            tail.append(" = " + refs[c.column])
+        if self._wheres:
+            tail.append(" AND ")
+            self._render_list(tail, self._wheres, " AND ", _emit_node)
+        return "".join(out), row_sql, "".join(tail) + postfix
+
+    def _check_row(self, row):
+        if len(row) != len(self._columns):
+            raise SqlException("Expected %i values per row, got %i" % (len(self._columns), len(row)))
+        if not self._ignore_none and any(v is None for v in row):
+            raise SqlException("None value given")
+        return row
+
+    def _iter_rows(self, it, beautiful, complete):
+        prefix, row_sql, postfix = self._build_rows_parts(beautiful, complete)
+        max_rows = min(max(1, SqlQuery.MAX_VARIABLES // len(self._columns)),
+                       max(1, (SqlQuery.MAX_SQL_LENGTH - len(prefix) - len(postfix)) // (len(row_sql) + 2)))
+
+        while True:
+            chunk = list(itertools.islice(it, max_rows))
+            if not chunk:
+                return
+
+            params = []
+            for row in chunk:
+                params.extend(self._check_row(row))
+            yield prefix + ", ".join([row_sql] * len(chunk)) + postfix, tuple(params)
+
+    # Execution, see pearsql.engine and pearsql.aio. Returns awaitables for asynchronous engines
+    def execute(self, engine, params=None):
+        return engine.execute(self, params)
+
+    def fetchall(self, engine, params=None):
+        return engine.fetchall(self, params)
+
+    def fetchone(self, engine, params=None):
+        return engine.fetchone(self, params)
+
+    def stream(self, engine, params=None, **kwargs):
+        return engine.stream(self, params, **kwargs)
+
+    def fetch_columns(self, engine, params=None, **kwargs):
+        return engine.fetch_columns(self, params, **kwargs)
+
+    # Query plan, connection is a sqlite3 connection or an engine. See pearsql.explain
+    def explain(self, connection, params=None):
+        from .explain import explain
+        return explain(self, connection, params)
+
+    def compile(self, beautiful=False, complete=True, cache=True):
+        if not cache:
+            params = []
+            sql = self._build(beautiful, complete, params)
+            return SqlTemplate(sql, params, _query_tables(self), self._written_tables())
+
+        key = (beautiful, complete, self._structure_key())
+        try:
+            template = SqlQuery._template_cache.get(key)
+        except TypeError:  # Unhashable literal
+            return self.compile(beautiful, complete, False)
+
+        if template is None:
+            template = self.compile(beautiful, complete, False)
+            SqlQuery._template_cache.put(key, template)
+        return template
+
+    def _written_tables(self):
         if self._operation == _SqlOperationType.SELECT:
-            q = "SELECT"
-            if self._select_distinct:
-                q += " DISTINCT"
-            q += sep
-
-            q += self._build_select_columns() + sep
-            q += "FROM " + self._build_tables() + sep
-            if self._joins:
-                q += self._build_joins() + sep
-            if self._wheres:
-                q += self._build_where() + sep
-            if self._havings:
-                q += self._build_having() + sep
-            if self._groupby_list:
-                q += self._build_groupby() + sep
-            if self._orderby_table:
-                q += self._build_orderby() + sep
-            if self._limit > 0:
-                q += "LIMIT " + str(self._limit) + sep
-            if self._offset > 0:
-                q += "OFFSET " + str(self._offset) + sep
-            if self._union:
-                q += "UNION " + self._union.build(beautiful, False)
-        elif self._operation == _SqlOperationType.INSERT:
-            self._use_aliases = False  # No aliases allowed
-            q = "INSERT INTO "
-            q += self._build_tables() + " "
-            if self._columns:
-                q += "(" + self._build_insert_columns() + ")" + sep
-                q += "VALUES " + self._build_values() + sep
-            else:
-                q += "DEFAULT VALUES" + sep
-        elif self._operation == _SqlOperationType.UPDATE:
-            self._use_aliases = False  # No aliases allowed
-            q = "UPDATE "
-            q += self._build_tables() + sep
-            q += "SET " + self._build_set_values() + sep
-            if self._joins:
-                q += self._build_joins() + sep
-            if self._wheres:
-                q += self._build_where() + sep
-            if self._havings:
-                q += self._build_having() + sep
-            if self._orderby_table:
-                q += self._build_orderby() + sep
-            if self._limit > 0:
-                q += "LIMIT " + str(self._limit) + sep
-            if self._offset > 0:
-                q += "OFFSET " + str(self._offset) + sep
-        elif self._operation == _SqlOperationType.DELETE:
-            self._use_aliases = False  # No aliases allowed
-            q = "DELETE FROM " + sep
-            q += self._build_tables() + sep
-            if self._wheres:
-                q += self._build_where() + sep
-            if self._orderby_table:
-                q += self._build_orderby() + sep
-            if self._limit > 0:
-                q += "LIMIT " + str(self._limit) + sep
-            if self._offset > 0:
-                q += "OFFSET " + str(self._offset) + sep
-
+            return set()
+        return set(t._name.lower() for t in self._tables)
+
+    # Hashable key of the query tree, equal for queries rendering the same SQL. Without literals, queries
+    # differing only in their values share the key. Only the nodes are cached, as the query itself is mutable
+    def structural_key(self, literals=True):
+        return self._structure_key(literals)
+
+    # Stable digest of structural_key(), by default without literals, i.e. of the query shape
+    def fingerprint(self, literals=False):
+        return hashlib.sha1(repr(self._structure_key(literals)).encode("utf-8")).hexdigest()
+
+    def _structure_key(self, literals=True):
+        return ("Q", self._operation, self._select_distinct, self._limit, self._offset,
+                self._ignore_none, self._use_quotes, self._use_aliases, self._in_list_threshold,
+                _structure_key(self._tables, literals), _structure_key(self._columns, literals),
+                _structure_key(self._joins, literals), _structure_key(self._wheres, literals),
+                _structure_key(self._havings, literals), _structure_key(self._groupby_list, literals),
+                tuple((t, _structure_key(c, literals)) for t, c in self._orderby_table.values()),
+                _structure_key(self._unions, literals), _structure_key(self._seek, literals),
+                _structure_key(self._conflict, literals), _structure_key(self._match, literals),
+                _structure_key(self._index, literals))
+
+    # Literals are appended to params and replaced by '?' placeholders if params is not None
+    def _build(self, beautiful, complete, params):
+        out = []
+        if _hooks:
+            start = clock()
+            self._render_into(out, beautiful, complete, params)
+            sql = "".join(out)
+            _notify("build", self, sql, params, clock() - start)
+            return sql
+        self._render_into(out, beautiful, complete, params)
+        return "".join(out)
+
+    def _render_into(self, out, beautiful, complete, params):
+        render = SqlQuery._statement_renderers.get(self._operation)
+        if render is not None:
+            render(self._render_state(params), out, "\n" if beautiful else " ", beautiful)
         if complete:
-            return q + ";"
+            out.append(";")
+
+    # Shallow copy holding the state of one rendering, so building never modifies the query
+    def _render_state(self, params):
+        query = self._shallow_copy()
+        query._params = params
+        return query
+
+    def _render_select(self, out, sep, beautiful):
+        out.append("SELECT DISTINCT" + sep if self._select_distinct else "SELECT" + sep)
+        self._render_select_columns(out)
+        out.append(sep + "FROM ")
+        self._render_tables(out)
+        out.append(sep)
+        if self._joins:
+            self._render_joins(out)
+            out.append(sep)
+        if self._wheres or self._seek is not None:
+            self._render_where(out)
+            out.append(sep)
+        if self._havings:
+            self._render_having(out)
+            out.append(sep)
+        if self._groupby_list:
+            self._render_groupby(out)
+            out.append(sep)
+        if self._orderby_table:
+            self._render_orderby(out)
+            out.append(sep)
+        self._render_limit(out, sep)
+        for all, q in self._unions:
+            out.append("UNION ALL " if all else "UNION ")
+            _render_nested(out, q, beautiful, self._params)
+
+    def _render_insert(self, out, sep, beautiful):
+        self._use_aliases = False  # No aliases allowed
+        out.append("INSERT INTO ")
+        self._render_tables(out)
+        out.append(" ")
+        if self._columns:
+            out.append("(")
+            self._render_insert_columns(out)
+            out.append(")" + sep + "VALUES ")
+            self._render_values(out)
+            out.append(sep)
         else:
-            return q
+            out.append("DEFAULT VALUES" + sep)
+        if self._conflict is not None:
+            self._render_conflict(out)
+            out.append(sep)
+
+    def _render_update(self, out, sep, beautiful):
+        self._use_aliases = False  # No aliases allowed
+        out.append("UPDATE ")
+        self._render_tables(out)
+        out.append(sep + "SET ")
+        self._render_set_values(out)
+        out.append(sep)
+        if self._joins:
+            self._render_joins(out)
+            out.append(sep)
+        if self._wheres:
+            self._render_where(out)
+            out.append(sep)
+        if self._havings:
+            self._render_having(out)
+            out.append(sep)
+        if self._orderby_table:
+            self._render_orderby(out)
+            out.append(sep)
+        self._render_limit(out, sep)
+
+    def _render_delete(self, out, sep, beautiful):
+        self._use_aliases = False  # No aliases allowed
+        out.append("DELETE FROM " + sep)
+        self._render_tables(out)
+        out.append(sep)
+        if self._wheres:
+            self._render_where(out)
+            out.append(sep)
+        if self._orderby_table:
+            self._render_orderby(out)
+            out.append(sep)
+        self._render_limit(out, sep)
+
+    def _render_create_index(self, out, sep, beautiful):
+        self._use_aliases = False  # No aliases allowed
+        self._params = None  # Partial indexes can't have parameters
+        index = self._index
+        table = self._tables[0]
+        columns = [c.column for c in self._columns]
+        columns.extend(c.column for c in index.covering if c.column not in columns)
+        name = index.name or "idx_%s_%s" % (table._name, "_".join(columns))
+
+        out.append("CREATE UNIQUE INDEX " if index.unique else "CREATE INDEX ")
+        if index.if_not_exists:
+            out.append("IF NOT EXISTS ")
+        out.append(_enquote(self, name) + " ON ")
+        self._render_tables(out)
+        out.append(" (" + ", ".join(_enquote(self, c) for c in columns) + ")" + sep)
+        if self._wheres:
+            self._render_where(out)
+            out.append(sep)
+
+    _statement_renderers = {
+        _SqlOperationType.SELECT: _render_select,
+        _SqlOperationType.INSERT: _render_insert,
+        _SqlOperationType.UPDATE: _render_update,
+        _SqlOperationType.DELETE: _render_delete,
+        _SqlOperationType.CREATE_INDEX: _render_create_index,
+    }
+
+
+_emitters = {
+    SqlQuery: _emit_query,
+    _SqlTable: _emit_table,
+    _SqlColumn: _emit_column,
+}
+for _t in __string_types:
+    _emitters[_t] = _emit_string
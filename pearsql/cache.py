@@ -0,0 +1,98 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+def _size(rows):
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for v in row or ():
+            size += sys.getsizeof(v)
+    return size
+
+
+# LRU cache of query results, bounded by entry count and (estimated) bytes, with an optional time to live.
+# Entries are tagged with the tables of their query and dropped when one of them is written
+class SqlResultCache(object):
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (rows, tables, size, expires)
+        self._by_table = {}
+        self._generations = {}
+        self._epoch = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or (entry[3] is not None and entry[3] < _clock()):
+                if entry is not None:
+                    self._forget(key, entry)
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    # Write counters of the tables, to be passed to put(). Results are only stored if no table was
+    # invalidated in between, so a result read concurrently to a write is never cached
+    def snapshot(self, tables):
+        with self._lock:
+            return self._epoch, tuple(self._generations.get(t, 0) for t in tables)
+
+    def put(self, key, tables, snapshot, rows):
+        size = _size(rows)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if snapshot != (self._epoch, tuple(self._generations.get(t, 0) for t in tables)):
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._forget(key, old)
+            expires = _clock() + self.ttl if self.ttl is not None else None
+            self._entries[key] = (rows, tables, size, expires)
+            self._bytes += size
+            for t in tables:
+                self._by_table.setdefault(t, set()).add(key)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                old_key, old = self._entries.popitem(last=False)
+                self._forget(old_key, old)
+
+    def _forget(self, key, entry):
+        self._bytes -= entry[2]
+        for t in entry[1]:
+            keys = self._by_table.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[t]
+
+    def invalidate(self, tables):
+        with self._lock:
+            for t in tables:
+                t = t.lower()
+                self._generations[t] = self._generations.get(t, 0) + 1
+                for key in list(self._by_table.get(t, ())):
+                    entry = self._entries.pop(key, None)
+                    if entry is not None:
+                        self._forget(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
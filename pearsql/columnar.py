@@ -0,0 +1,113 @@
+import array
+from collections import OrderedDict, namedtuple
+
+import six
+
+from .builder import SqlException
+from .schema import SqlSchemaException
+
+_NAN = float("nan")
+
+
+# Array typecode of a declared column type by the SQLite affinity rules: 'q' (INTEGER), 'd' (REAL),
+# '' (TEXT, BLOB: Python objects) or None (NUMERIC: decided by the first values)
+def _typecode(declared):
+    declared = declared.upper()
+    if "INT" in declared:
+        return "q"
+    elif "CHAR" in declared or "CLOB" in declared or "TEXT" in declared or "BLOB" in declared or not declared:
+        return ""
+    elif "REAL" in declared or "FLOA" in declared or "DOUB" in declared:
+        return "d"
+    return None
+
+
+# Values of one column, kept in a typed array as long as they fit. Integer columns containing NULL or REAL
+# values turn into 'd' arrays (NULL as NaN), anything else into a list
+class _SqlColumnBuffer(object):
+    __slots__ = ("typecode", "data")
+
+    def __init__(self, typecode):
+        self.typecode = typecode
+        self.data = array.array(typecode) if typecode else []
+
+    def extend(self, values):
+        if self.typecode is None:
+            first = next((v for v in values if v is not None), None)
+            if first is None:
+                self.data.extend(values)
+                return
+            self.typecode = "q" if isinstance(first, six.integer_types) else \
+                "d" if isinstance(first, float) else ""
+            old = self.data
+            self.data = array.array(self.typecode) if self.typecode else []
+            if old:
+                self.extend(old)
+
+        if self.typecode == "q":
+            size = len(self.data)
+            try:
+                self.data.extend(values)
+                return
+            except (TypeError, OverflowError):
+                del self.data[size:]
+                self._convert("d")
+        if self.typecode == "d":
+            size = len(self.data)
+            try:
+                self.data.extend([_NAN if v is None else v for v in values])
+                return
+            except (TypeError, OverflowError):
+                del self.data[size:]
+                self._convert("")
+        self.data.extend(values)
+
+    def _convert(self, typecode):
+        self.data = array.array(typecode, self.data) if typecode else list(self.data)
+        self.typecode = typecode
+
+    def result(self, numpy):
+        if numpy is None:
+            return self.data
+        elif self.typecode == "q":
+            return numpy.frombuffer(self.data, dtype=numpy.int64) if self.data else numpy.zeros(0, numpy.int64)
+        elif self.typecode == "d":
+            return numpy.frombuffer(self.data, dtype=numpy.float64) if self.data else numpy.zeros(0, numpy.float64)
+        return numpy.array(self.data, dtype=object)
+
+
+# One buffer per selected column, in select list order
+# noinspection PyProtectedMember
+def _buffers(query, schema):
+    buffers = []
+    for c in query._columns:
+        try:
+            info = schema.table_info(c.table._name).column(c.column)
+        except SqlSchemaException:
+            info = None
+        buffers.append(_SqlColumnBuffer(_typecode(info.type) if info is not None else None))
+    return buffers
+
+
+# Fills one buffer per selected column in batches from the cursor, without keeping the rows
+# noinspection PyProtectedMember
+def fetch_columns(cursor, query, schema, batch_size=4096, numpy=False):
+    if not query._columns:
+        raise SqlException("Need columns for fetch_columns")
+    if numpy:
+        import numpy
+    else:
+        numpy = None
+
+    # Named like the fields of stream() rows: Duplicate names of different columns are renamed to _<position>
+    names = namedtuple("Row", [c.alias or c.column for c in query._columns], rename=True)._fields
+    buffers = _buffers(query, schema)
+    count = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        count += len(batch)
+        for buffer, values in zip(buffers, zip(*batch)):
+            buffer.extend(values)
+    return OrderedDict((name, b.result(numpy)) for name, b in zip(names, buffers)), count
@@ -0,0 +1,369 @@
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import six
+from six.moves import queue
+
+from .builder import SqlQuery, SqlTemplate, SqlException, SqlDatabase, _SqlOperationType, _statement, _query_tables
+from .columnar import fetch_columns
+from .explain import SqlPlan, check_plan, _explain_rows
+from .instrument import _hooks, _notify, clock
+
+
+_row_types = {}
+
+# Plain SQL statements that leave the cached tables alone: Reads, query plans and pragmas
+_READ_STATEMENTS = frozenset(("SELECT", "VALUES", "EXPLAIN", "PRAGMA"))
+_FIRST_WORD = re.compile(r"\s*(\w*)")
+_WRITE_WORDS = re.compile(r"\b(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+# Temporary tables are per connection, while cached results are shared
+_TEMP_PREFIXES = ("pearsql_values_", "temp.")
+
+
+def _is_read(sql):
+    word = _FIRST_WORD.match(sql).group(1).upper()
+    if word == "WITH":
+        return _WRITE_WORDS.search(sql) is None
+    return word in _READ_STATEMENTS
+
+
+# Compact row type named after the select list of the query, or the cursor description for 'SELECT *'
+# noinspection PyProtectedMember
+def _row_type(query, cursor):
+    if isinstance(query, SqlQuery) and query._columns:
+        names = tuple(c.alias or c.column for c in query._columns)
+    else:
+        names = tuple(d[0] for d in cursor.description)
+
+    row_type = _row_types.get(names)
+    if row_type is None:
+        row_type = _row_types[names] = namedtuple("Row", names, rename=True)
+    return row_type
+
+
+class _SqlLease(object):
+    __slots__ = ("conn", "users")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.users = 1
+
+
+class SqlEngine:
+    # Applied once to every new connection, in this order
+    PRAGMAS = (("journal_mode", "WAL"), ("synchronous", "NORMAL"))
+    # Query plan check of every distinct statement: None, "warn" or "raise", see pearsql.explain.check_plan
+    EXPLAIN = None
+
+    # cache: Optional pearsql.cache.SqlResultCache for the results of fetchall() and fetchone()
+    def __init__(self, database, pool_size=4, timeout=5.0, pragmas=None, cached_statements=256, explain=None,
+                 cache=None, **kwargs):
+        self.database = database
+        self.timeout = timeout
+        self.explain = SqlEngine.EXPLAIN if explain is None else explain
+        self._explained = set()
+        self._schema = None
+        self.cache = cache
+        self.pragmas = SqlEngine.PRAGMAS if pragmas is None else tuple(pragmas)
+        if database == ":memory:":
+            pool_size = 1  # Every connection would open its own database
+        self.pool_size = pool_size
+
+        self._connect_args = dict(kwargs, timeout=timeout, cached_statements=cached_statements,
+                                  isolation_level=None, check_same_thread=False)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, **self._connect_args)
+        for name, value in self.pragmas:
+            conn.execute("PRAGMA %s = %s" % (name, value))
+        return conn
+
+    def _acquire(self):
+        if self._closed:
+            raise SqlException("Engine is closed")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.pool_size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise SqlException("No connection available after %s seconds" % self.timeout)
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    # Connection of the calling thread, taken from the pool. Nested calls reuse the same connection, which goes
+    # back to the pool when its last user is done: Open streams keep it, even if the call that took it ended
+    @contextmanager
+    def connection(self):
+        lease = getattr(self._local, "lease", None)
+        with self._lock:
+            shared = lease is not None and lease.users > 0
+            if shared:
+                lease.users += 1
+        if not shared:
+            lease = self._local.lease = _SqlLease(self._acquire())
+        try:
+            yield lease.conn
+        finally:
+            with self._lock:
+                lease.users -= 1
+                done = lease.users == 0
+            if done:  # The lease stays in the thread-local, as this may run on another thread (generators)
+                self._release(lease.conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            if conn.in_transaction:  # Nested transaction, handled by the outer one
+                yield conn
+                return
+
+            conn.execute("BEGIN")
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                if self.cache is not None:
+                    self._flush_pending()
+
+    # noinspection PyProtectedMember
+    def _execute_statement(self, conn, query, sql, params):
+        if self.explain and sql not in self._explained and not (
+                isinstance(query, SqlQuery) and query._operation == _SqlOperationType.INSERT):
+            check_plan(query, SqlPlan(sql, _explain_rows(conn, sql, params)), self.explain)
+            self._explained.add(sql)
+        return conn.execute(sql, params)
+
+    # (tables read, tables written) of a statement, None if unknown (plain SQL)
+    # noinspection PyProtectedMember
+    @staticmethod
+    def _tables(query):
+        if isinstance(query, SqlQuery):
+            return _query_tables(query), query._written_tables()
+        elif isinstance(query, SqlTemplate):
+            return query.tables, query.written
+        return None
+
+    # Drops cached results of the written tables, once more after the commit of a running transaction
+    def _invalidate(self, conn, query):
+        tables = SqlEngine._tables(query)
+        if tables is None:
+            if isinstance(query, six.string_types) and _is_read(query):
+                return
+            written = None
+        elif not tables[1]:
+            return
+        else:
+            written = tables[1]
+
+        if written is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(written)
+        if conn.in_transaction:
+            pending = getattr(self._local, "pending", None)
+            if pending is None:
+                pending = self._local.pending = []
+            pending.append(written)
+
+    def _flush_pending(self):
+        pending = getattr(self._local, "pending", None)
+        self._local.pending = None
+        for written in pending or ():
+            if written is None:
+                self.cache.clear()
+            else:
+                self.cache.invalidate(written)
+
+    def _fetch(self, query, params, one):
+        tables = SqlEngine._tables(query) if self.cache is not None else None
+        if tables is None or tables[1] or any(t.startswith(_TEMP_PREFIXES) for t in tables[0]):
+            with self.connection() as conn:
+                sql, params = _statement(query, params)
+                start = clock() if _hooks else None
+                cursor = self._execute_statement(conn, query, sql, params)
+                result = cursor.fetchone() if one else cursor.fetchall()
+                if start is not None:
+                    _notify("execute", query, sql, params, clock() - start,
+                            int(result is not None) if one else len(result), conn)
+                if self.cache is not None:
+                    self._invalidate(conn, query)
+                return result
+
+        sql = None
+        try:
+            if isinstance(query, SqlQuery):  # Keyed by the query tree, so hits are not rendered
+                key = (one, query.structural_key(), tuple(sorted(params.items())) if params else None)
+            else:
+                sql, params = _statement(query, params)
+                key = (one, sql, params)
+            rows = self.cache.get(key)
+        except TypeError:  # Unhashable literals or parameters
+            key, rows = None, None
+        if rows is not None:
+            return rows[0] if one else list(rows)
+        if sql is None:
+            sql, params = _statement(query, params)
+
+        tables = tuple(sorted(tables[0]))
+        snapshot = self.cache.snapshot(tables)
+        with self.connection() as conn:
+            start = clock() if _hooks else None
+            cursor = self._execute_statement(conn, query, sql, params)
+            rows = (cursor.fetchone(),) if one else tuple(cursor.fetchall())
+            if start is not None:
+                _notify("execute", query, sql, params, clock() - start,
+                        int(rows[0] is not None) if one else len(rows), conn)
+        if key is not None:
+            self.cache.put(key, tables, snapshot, rows)
+        return rows[0] if one else list(rows)
+
+    def execute(self, query, params=None):
+        with self.connection() as conn:
+            sql, params = _statement(query, params)
+            start = clock() if _hooks else None
+            rowcount = self._execute_statement(conn, query, sql, params).rowcount
+            if start is not None:
+                _notify("execute", query, sql, params, clock() - start, rowcount, conn)
+            if self.cache is not None:
+                self._invalidate(conn, query)
+            return rowcount
+
+    def fetchall(self, query, params=None):
+        return self._fetch(query, params, False)
+
+    def fetchone(self, query, params=None):
+        return self._fetch(query, params, True)
+
+    # Iterates the result in batches of batch_size rows, keeping the connection until exhausted or closed.
+    # Hooks are notified on close, with the time including the consumer
+    def stream(self, query, params=None, batch_size=256):
+        with self.connection() as conn:
+            sql, params = _statement(query, params)
+            start = clock() if _hooks else None
+            cursor = self._execute_statement(conn, query, sql, params)
+            count = 0
+            try:
+                make = _row_type(query, cursor)._make
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    count += len(batch)
+                    for row in map(make, batch):
+                        yield row
+            finally:
+                cursor.close()
+                if start is not None:
+                    _notify("execute", query, sql, params, clock() - start, count, conn)
+
+    # Result of a select with columns as one array.array (or NumPy array) per column, by column alias or name.
+    # Array types follow the declared column types, see pearsql.columnar
+    def fetch_columns(self, query, params=None, batch_size=4096, numpy=False):
+        schema = self.schema()
+        with self.connection() as conn:
+            sql, params = _statement(query, params)
+            start = clock() if _hooks else None
+            cursor = self._execute_statement(conn, query, sql, params)
+            try:
+                columns, count = fetch_columns(cursor, query, schema, batch_size, numpy)
+            finally:
+                cursor.close()
+            if start is not None:
+                _notify("execute", query, sql, params, clock() - start, count, conn)
+            return columns
+
+    # Reflected schema (pearsql.schema.SqlSchema), loaded on first use
+    def schema(self, refresh=False):
+        if self._schema is None or refresh:
+            from .schema import SqlSchema
+            self._schema = SqlSchema.load(self)
+        return self._schema
+
+    # Loads values into a temporary table on the connection of the calling thread, for value sets too large
+    # to pass with the statement. The yielded table is meant for in_(): D.book.id.in_(table)
+    @contextmanager
+    def temp_values(self, values):
+        with self.connection() as conn:
+            depth = getattr(self._local, "temp_depth", 0)
+            name = "pearsql_values_%i" % depth
+            conn.execute('CREATE TEMP TABLE "%s" (value)' % name)
+            self._local.temp_depth = depth + 1
+            try:
+                conn.executemany('INSERT INTO temp."%s" VALUES (?)' % name, ((v,) for v in values))
+                yield getattr(SqlDatabase, name)
+            finally:
+                self._local.temp_depth = depth
+                conn.execute('DROP TABLE temp."%s"' % name)
+
+    # Executes one statement for each entry of rows inside a single transaction:
+    # Value tuples for insert (or upsert) queries with columns and update queries with match() columns,
+    # parameter dicts for compiled templates
+    # noinspection PyProtectedMember
+    def executemany(self, query, rows):
+        if isinstance(query, SqlQuery):
+            if not query._columns or not (query._operation == _SqlOperationType.INSERT or query._match):
+                raise SqlException("Need Insert or batched Update operator with columns for executemany")
+            prefix, row_sql, postfix = query._build_rows_parts(False, True)
+            sql = prefix + row_sql + postfix
+            rows = (query._check_row(row) for row in rows)
+        elif isinstance(query, SqlTemplate):
+            sql = query.sql
+            rows = (query.bind(values) for values in rows)
+        else:
+            sql = query
+
+        with self.transaction() as conn:
+            start = clock() if _hooks else None
+            rowcount = conn.executemany(sql, rows).rowcount
+            if start is not None:
+                _notify("execute", query, sql, None, clock() - start, rowcount, conn)
+            if self.cache is not None:
+                self._invalidate(conn, query)
+            return rowcount
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,171 @@
+import re
+import warnings
+
+from .builder import SqlQuery, SqlException, SqlFunction, _SqlColumn, _SqlWhereCondition, _SqlRowValue, _statement
+
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\S+)")
+_TEMP_BTREE = re.compile(r"^USE TEMP B-TREE FOR (.+)$")
+
+
+class SqlPlanWarning(UserWarning):
+    pass
+
+
+class SqlPlanException(SqlException):
+    pass
+
+
+class SqlPlanNode(object):
+    __slots__ = ("id", "parent", "detail", "children")
+
+    def __init__(self, id, parent, detail):
+        self.id = id
+        self.parent = parent
+        self.detail = detail
+        self.children = []
+
+    # Name (or alias) of the table read completely, None if the node is no full table scan
+    @property
+    def scanned_table(self):
+        m = _SCAN.match(self.detail)
+        if m is None or " USING " in self.detail or "VIRTUAL TABLE" in self.detail:
+            return None
+        if m.group(1) == "CONSTANT" or m.group(1).startswith("("):  # SCAN CONSTANT ROW, SCAN (subquery-1)
+            return None
+        return m.group(1)
+
+    # 'ORDER BY', 'GROUP BY', 'DISTINCT', ... if the node sorts through a temporary B-tree
+    @property
+    def temp_btree(self):
+        m = _TEMP_BTREE.match(self.detail)
+        return m.group(1) if m else None
+
+    def __repr__(self):
+        return "SqlPlanNode(%r)" % self.detail
+
+
+class SqlPlan(object):
+    def __init__(self, sql, rows):
+        self.sql = sql
+        self.roots = []
+        self.nodes = []
+        nodes = {}
+        for row in rows:
+            node = SqlPlanNode(row[0], row[1], row[3])
+            nodes[node.id] = node
+            self.nodes.append(node)
+            parent = nodes.get(node.parent)
+            if parent is not None:
+                parent.children.append(node)
+            else:
+                self.roots.append(node)
+
+    def full_scans(self):
+        return [n for n in self.nodes if n.scanned_table is not None]
+
+    def temp_btrees(self):
+        return [n for n in self.nodes if n.temp_btree is not None]
+
+    def __str__(self):
+        lines = []
+        stack = [(n, 0) for n in reversed(self.roots)]
+        while stack:
+            node, depth = stack.pop()
+            lines.append("  " * depth + node.detail)
+            stack.extend((c, depth + 1) for c in reversed(node.children))
+        return "\n".join(lines)
+
+
+# EXPLAIN does not check the schema version, so SQLite plans with the schema the connection read last (missing
+# indexes created by other connections), and the sqlite3 statement cache keeps such plans. Reading the version
+# reloads a changed schema, and the version in the statement text keeps out the cached plans of older versions
+def _explain_rows(conn, sql, params):
+    version = conn.execute("SELECT schema_version FROM pragma_schema_version").fetchone()[0]
+    return conn.execute("/* schema %i */ EXPLAIN QUERY PLAN %s" % (version, sql), params or ()).fetchall()
+
+
+# connection is a sqlite3 connection or a pearsql.engine.SqlEngine
+def explain(query, connection, params=None):
+    sql, params = _statement(query, params)
+    if hasattr(connection, "connection"):
+        with connection.connection() as conn:
+            return SqlPlan(sql, _explain_rows(conn, sql, params))
+    return SqlPlan(sql, _explain_rows(connection, sql, params))
+
+
+# Columns referenced by conditions and expressions, without descending into subqueries
+def _collect_columns(nodes):
+    columns = []
+    stack = list(reversed(nodes))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, _SqlColumn):
+            columns.append(node)
+        elif isinstance(node, _SqlWhereCondition):
+            stack.extend(reversed(node._operands()))
+        elif isinstance(node, SqlFunction):
+            stack.append(node._op)
+        elif isinstance(node, _SqlRowValue):
+            stack.extend(reversed(node._items))
+    return columns
+
+
+# Columns of the query by the clause using them: where, join (joined table only), groupby and orderby
+# noinspection PyProtectedMember
+def _clause_columns(query):
+    clauses = [("where", _collect_columns(query._wheres))]
+    joined = []
+    for j in query._joins:
+        joined.extend(c for c in _collect_columns([j.condition]) if c.table._name == j.other_table._name)
+    clauses.append(("join", joined))
+    clauses.append(("groupby", _collect_columns(query._groupby_list)))
+    clauses.append(("orderby", _collect_columns([c for _, c in query._orderby_table.values()])))
+    return clauses
+
+
+# noinspection PyProtectedMember
+def _table_names(query):
+    names = {}
+    for t in list(query._tables) + [j.other_table for j in query._joins]:
+        names[t._name] = t._name
+        if t._alias:
+            names[t._alias] = t._name
+    return names
+
+
+# Problems of the plan as (description, candidate index columns as 'table.column')
+def plan_problems(query, plan):
+    clauses = _clause_columns(query) if isinstance(query, SqlQuery) else []
+    names = _table_names(query) if isinstance(query, SqlQuery) else {}
+
+    problems = []
+    for node in plan.full_scans():
+        table = names.get(node.scanned_table, node.scanned_table)
+        columns = []
+        for _, cs in clauses:
+            for c in cs:
+                name = "%s.%s" % (table, c.column)
+                if c.table._name == table and name not in columns:
+                    columns.append(name)
+        if columns:
+            problems.append(("full scan of table '%s'" % table, columns))
+    for node in plan.temp_btrees():
+        clause = node.temp_btree.replace(" ", "").lower()
+        columns = ["%s.%s" % (c.table._name, c.column) for name, cs in clauses if name == clause for c in cs]
+        problems.append(("temporary B-tree for %s" % node.temp_btree, columns))
+    return problems
+
+
+# Raises SqlPlanException (mode 'raise') or warns with SqlPlanWarning (mode 'warn') about full table scans
+# and temporary B-trees, listing the columns which need an index
+def check_plan(query, plan, mode="raise"):
+    problems = plan_problems(query, plan)
+    if not problems:
+        return plan
+
+    message = "Query '%s':\n%s\nPlan:\n%s" % (plan.sql, "\n".join(
+        "  %s, index candidates: %s" % (d, ", ".join(cs) or "-") for d, cs in problems), plan)
+    if mode == "raise":
+        raise SqlPlanException(message)
+    warnings.warn(message, SqlPlanWarning, stacklevel=3)
+    return plan
@@ -0,0 +1,131 @@
+import logging
+import re
+import threading
+import time
+
+clock = getattr(time, "perf_counter", time.time)
+
+# Registered hooks, called with a SqlEvent. Checked for emptiness only, so instrumentation costs nothing
+# while no hook is registered
+_hooks = []
+
+
+class SqlEvent(object):
+    __slots__ = ("kind", "query", "sql", "params", "seconds", "rows", "connection")
+
+    # kind: 'build' (rendering a query) or 'execute' (running a statement, including fetching its rows)
+    def __init__(self, kind, query, sql, params, seconds, rows=None, connection=None):
+        self.kind = kind
+        self.query = query
+        self.sql = sql
+        self.params = params
+        self.seconds = seconds
+        self.rows = rows
+        self.connection = connection
+
+    @property
+    def fingerprint(self):
+        return fingerprint(self.sql)
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def _notify(kind, query, sql, params, seconds, rows=None, connection=None):
+    event = SqlEvent(kind, query, sql, params, seconds, rows, connection)
+    for hook in list(_hooks):
+        hook(event)
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w\".])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b|:\w+")
+_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_SPACES = re.compile(r"\s+")
+
+
+# Statement with literals and bound parameters replaced by '?' and value lists collapsed to '?, ...',
+# so all executions of one query shape share a fingerprint
+def fingerprint(sql):
+    sql = _LITERALS.sub("?", sql)
+    sql = _LISTS.sub("?, ...", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+class _SqlStatsEntry(object):
+    __slots__ = ("count", "seconds", "rows", "samples", "position")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.samples = []
+        self.position = 0
+
+
+def _percentile(samples, p):
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+# Hook aggregating count, latency percentiles and returned rows per fingerprint of executed statements.
+# Percentiles are computed over the last 'samples' executions
+class SqlStats(object):
+    def __init__(self, samples=1024):
+        self.max_samples = samples
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        if event.kind != "execute":
+            return
+        key = event.fingerprint
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _SqlStatsEntry()
+            entry.count += 1
+            entry.seconds += event.seconds
+            entry.rows += max(0, event.rows or 0)
+            if len(entry.samples) < self.max_samples:
+                entry.samples.append(event.seconds)
+            else:
+                entry.samples[entry.position] = event.seconds
+                entry.position = (entry.position + 1) % self.max_samples
+
+    # One dict per fingerprint, the most expensive (total time) first
+    def report(self):
+        with self._lock:
+            entries = [(k, e.count, e.seconds, e.rows, sorted(e.samples)) for k, e in self._entries.items()]
+        return sorted(({"fingerprint": k, "count": count, "total": seconds, "rows": rows,
+                        "p50": _percentile(samples, 0.5), "p99": _percentile(samples, 0.99)}
+                       for k, count, seconds, rows, samples in entries), key=lambda r: -r["total"])
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Hook logging executions slower than threshold seconds together with their query plan
+class SlowQueryLog(object):
+    def __init__(self, threshold=0.1, logger=None, explain=True):
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger("pearsql.slow")
+        self.explain = explain
+
+    def __call__(self, event):
+        if event.kind != "execute" or event.seconds < self.threshold:
+            return
+
+        plan = ""
+        if self.explain and event.connection is not None and event.sql.lstrip()[:7].upper() != "EXPLAIN":
+            from .explain import _explain_rows
+            try:
+                rows = _explain_rows(event.connection, event.sql, event.params)
+                plan = "\n" + "\n".join(r[3] for r in rows)
+            except Exception as e:
+                plan = "\n(no plan: %s)" % e
+        self.logger.warning("Slow query (%.3f s, %s rows): %s%s", event.seconds, event.rows, event.sql, plan)
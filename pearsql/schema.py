@@ -0,0 +1,156 @@
+from collections import OrderedDict
+
+import six
+
+from .builder import SqlException, _SqlTable, _ROWID_NAMES
+
+
+class SqlSchemaException(SqlException, AttributeError):
+    pass
+
+
+class SqlColumnInfo(object):
+    __slots__ = ("name", "type", "notnull", "default", "pk")
+
+    def __init__(self, name, type, notnull, default, pk):
+        self.name = name
+        self.type = type
+        self.notnull = notnull
+        self.default = default
+        self.pk = pk
+
+    def __repr__(self):
+        return "SqlColumnInfo(%r, %r)" % (self.name, self.type)
+
+
+class SqlIndexInfo(object):
+    __slots__ = ("name", "table", "columns", "unique", "partial")
+
+    def __init__(self, name, table, columns, unique, partial):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+        self.partial = partial
+
+    def __repr__(self):
+        return "SqlIndexInfo(%r, %r, %r)" % (self.name, self.table, self.columns)
+
+
+class SqlTableInfo(object):
+    def __init__(self, name, columns, indexes, view=False):
+        self.name = name
+        self.columns = OrderedDict((c.name, c) for c in columns)
+        self.indexes = indexes
+        self.view = view
+        self._columns = dict((c.name.lower(), c) for c in columns)
+
+    def column(self, name):
+        return self._columns.get(name.lower())
+
+    # The INTEGER PRIMARY KEY column, an alias of the rowid
+    @property
+    def rowid_column(self):
+        pks = [c for c in self.columns.values() if c.pk]
+        if len(pks) == 1 and pks[0].type.upper() == "INTEGER":
+            return pks[0]
+        return None
+
+    def has_column(self, name):
+        return name.lower() in self._columns or (not self.view and name.lower() in _ROWID_NAMES)
+
+    # Indexes usable to look up the given columns, i.e. having them as leading columns (in any order)
+    def indexes_for(self, *columns):
+        wanted = set(c.lower() for c in columns)
+        return [i for i in self.indexes
+                if not i.partial and set(c.lower() for c in i.columns[:len(wanted)] if c) == wanted]
+
+    def is_indexed(self, column):
+        rowid = self.rowid_column
+        if column.lower() in _ROWID_NAMES or (rowid is not None and rowid.name.lower() == column.lower()):
+            return True
+        return bool(self.indexes_for(column))
+
+
+# Table node validating its columns against the reflected schema
+class _SqlReflectedTable(_SqlTable):
+    __slots__ = ("_info", "_schema")
+
+    def __init__(self, schema, info, alias=None):
+        _SqlTable.__init__(self, info.name, alias)
+        self._schema = schema
+        self._info = info
+
+    def as_(self, alias):
+        return self._schema._table(self._info, alias)
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        if not self._info.has_column(item):
+            raise SqlSchemaException("Unknown column '%s.%s'" % (self._name, item))
+        return self._column(item)
+
+
+def _fetchall(connection, sql):
+    if hasattr(connection, "fetchall"):
+        return connection.fetchall(sql)
+    return connection.execute(sql).fetchall()
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+# Database reflected once from sqlite_master and the table and index pragmas.
+# Used like SqlDatabase: schema.book.title, but unknown tables and columns raise SqlSchemaException
+class SqlSchema(object):
+    def __init__(self, tables):
+        self._infos = dict((t.name.lower(), t) for t in tables)
+        self._nodes = {}
+
+    @staticmethod
+    def load(connection):
+        tables = []
+        for name, type in _fetchall(connection, "SELECT name, type FROM sqlite_master "
+                                                "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"):
+            columns = [SqlColumnInfo(r[1], r[2] or "", bool(r[3]), r[4], r[5])
+                       for r in _fetchall(connection, "PRAGMA table_info(%s)" % _quote(name))]
+            indexes = []
+            for r in _fetchall(connection, "PRAGMA index_list(%s)" % _quote(name)):
+                info = sorted(_fetchall(connection, "PRAGMA index_info(%s)" % _quote(r[1])))
+                partial = bool(r[4]) if len(r) > 4 else False
+                indexes.append(SqlIndexInfo(r[1], name, [c[2] for c in info], bool(r[2]), partial))
+            tables.append(SqlTableInfo(name, columns, indexes, type == "view"))
+        return SqlSchema(tables)
+
+    @property
+    def tables(self):
+        return sorted(t.name for t in self._infos.values())
+
+    def table_info(self, name):
+        info = self._infos.get(name.lower())
+        if info is None:
+            raise SqlSchemaException("Unknown table '%s'" % name)
+        return info
+
+    # Whether a column (node or 'table.column') is the rowid or the leading column of an index
+    # noinspection PyProtectedMember
+    def is_indexed(self, column):
+        if isinstance(column, six.string_types):
+            table, column = column.split(".", 1)
+        else:
+            table, column = column.table._name, column.column
+        return self.table_info(table).is_indexed(column)
+
+    def _table(self, info, alias=None):
+        key = (info.name, alias)
+        table = self._nodes.get(key)
+        if table is None:
+            table = self._nodes.setdefault(key, _SqlReflectedTable(self, info, alias))
+        return table
+
+    def __getattr__(self, item):
+        if item.startswith("__"):
+            raise AttributeError(item)
+        return self._table(self.table_info(item))
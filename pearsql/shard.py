@@ -0,0 +1,201 @@
+import heapq
+import itertools
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import six
+from six.moves import queue
+
+from .builder import SqlException, _SqlOrderByType, _statement
+from .engine import SqlEngine
+
+_END = object()
+
+# SQLite sort order of the storage classes: NULL, numbers, text, blobs
+_TYPE_RANKS = {type(None): 0, bool: 1, float: 1, six.text_type: 2, bytes: 3}
+for _t in six.integer_types:
+    _TYPE_RANKS[_t] = 1
+
+
+class _Descending(object):
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def _sort_value(v):
+    return (0, 0) if v is None else (_TYPE_RANKS.get(type(v), 2), v)
+
+
+# Sort key of result rows by the orderby() columns of the query, resolved against the row fields
+# noinspection PyProtectedMember
+def _order_key(query, fields):
+    positions = []
+    for type, c in query._orderby_table.values():
+        if query._columns:
+            index = next((i for i, e in enumerate(query._columns)
+                          if e.table._name == c.table._name and e.column == c.column), None)
+        else:
+            index = fields.index(c.column) if c.column in fields else None
+        if index is None:
+            raise SqlException("Orderby column '%s' not in the result" % c.column)
+        positions.append((index, type == _SqlOrderByType.DESC))
+
+    def key(row):
+        return tuple(_Descending(_sort_value(row[i])) if desc else _sort_value(row[i]) for i, desc in positions)
+    return key
+
+
+# Runs in worker processes, which can't share engines
+def _fetch_database(database, sql, params):
+    conn = sqlite3.connect(database)
+    try:
+        cursor = conn.execute(sql, params)
+        return tuple(d[0] for d in cursor.description), cursor.fetchall()
+    finally:
+        conn.close()
+
+
+# One select against several databases of the same schema (e.g. one file per month), queried in parallel.
+# shards are engines or database paths. Results are merged in orderby() order and LIMIT/OFFSET apply to the
+# merged result. With processes=True (paths only), each shard is read completely by a worker process
+class SqlShards(object):
+    def __init__(self, shards, batch_size=256, prefetch=2, processes=False):
+        self.processes = processes
+        if processes:
+            if not all(isinstance(s, six.string_types) for s in shards):
+                raise SqlException("Worker processes need database paths as shards")
+            self.shards = list(shards)
+            self._executor = ProcessPoolExecutor(max_workers=len(self.shards))
+        else:
+            self.shards = [SqlEngine(s) if isinstance(s, six.string_types) else s for s in shards]
+            self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="pearsql-shard")
+        self._owned = [s for s, o in zip(self.shards, shards) if s is not o]
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+
+    # noinspection PyProtectedMember
+    def stream(self, query, params=None):
+        limit, offset = query._limit, query._offset
+        if limit > 0 or offset > 0:  # Every shard might contribute all rows up to the global limit
+            query = query._shallow_copy()
+            query._limit = limit + offset if limit > 0 else 0
+            query._offset = 0
+        sql, params = _statement(query, params)
+        return self._merge(query, sql, params, offset, limit)
+
+    def fetchall(self, query, params=None):
+        return list(self.stream(query, params))
+
+    # The shards are read once iterated. All producers are stopped when done, also those of parts never
+    # started (closing these runs no finally)
+    def _merge(self, query, sql, params, offset, limit):
+        stops = []
+        if self.processes:
+            parts = self._read_processes(sql, params)
+        else:
+            parts = self._read_threads(sql, params, stops)
+        try:
+            if query._orderby_table:
+                firsts = []
+                for part in parts:
+                    row = next(part, _END)
+                    if row is not _END:
+                        firsts.append((row, part))
+                if not firsts:
+                    return
+                key = _order_key(query, firsts[0][0]._fields)
+                rows = heapq.merge(*[itertools.chain((row,), part) for row, part in firsts], key=key)
+            else:
+                rows = itertools.chain.from_iterable(parts)
+            for row in itertools.islice(rows, offset, offset + limit if limit > 0 else None):
+                yield row
+        finally:
+            for stop in stops:
+                stop.set()
+            for part in parts:
+                part.close()
+
+    def _read_processes(self, sql, params):
+        futures = [self._executor.submit(_fetch_database, s, sql, params) for s in self.shards]
+
+        def part(future):
+            names, rows = future.result()
+            row_type = namedtuple("Row", names, rename=True)
+            for row in rows:
+                yield row_type._make(row)
+        return [part(f) for f in futures]
+
+    def _read_threads(self, sql, params, stops):
+        parts = []
+        for engine in self.shards:
+            batches = queue.Queue(self.prefetch)
+            stop = threading.Event()
+            stops.append(stop)
+            self._executor.submit(self._produce, engine, sql, params, batches, stop)
+            parts.append(self._consume(batches, stop))
+        return parts
+
+    # Worker thread: Streams the rows of one shard in batches, blocking while the consumer is behind
+    def _produce(self, engine, sql, params, batches, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.05)
+                    return
+                except queue.Full:
+                    pass
+
+        try:
+            rows = engine.stream(sql, params, self.batch_size)
+            try:
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) >= self.batch_size:
+                        put(batch)
+                        batch = []
+                        if stop.is_set():
+                            return
+                if batch:
+                    put(batch)
+            finally:
+                rows.close()
+        except BaseException as e:
+            put(e)
+        else:
+            put(_END)
+
+    @staticmethod
+    def _consume(batches, stop):
+        try:
+            while True:
+                batch = batches.get()
+                if batch is _END:
+                    return
+                elif isinstance(batch, BaseException):
+                    raise batch
+                for row in batch:
+                    yield row
+        finally:
+            stop.set()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for engine in self._owned:
+            engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,160 @@
+import threading
+from concurrent.futures import Future
+
+from six.moves import queue
+
+from .builder import SqlQuery, SqlException, _SqlOperationType, _statement
+from .instrument import _hooks, _notify, clock
+
+_STOP = object()
+
+
+class _SqlWrite(object):
+    __slots__ = ("query", "sql", "params", "merge", "future")
+
+    # noinspection PyProtectedMember
+    def __init__(self, query, sql, params, future):
+        self.query = query
+        self.sql = sql
+        self.params = params
+        self.future = future
+        # Plain inserts insert exactly one row, so runs of them can be executed with one executemany()
+        self.merge = (isinstance(query, SqlQuery) and query._operation == _SqlOperationType.INSERT
+                      and query._conflict is None)
+
+
+# Consecutive writes executed together: A merged run of same-shape inserts, or a single statement
+def _groups(writes):
+    group = []
+    for write in writes:
+        if group and not (write.merge and group[-1].merge and write.sql == group[-1].sql):
+            yield group
+            group = []
+        group.append(write)
+    if group:
+        yield group
+
+
+# Write-behind queue: Writes submitted from any thread are executed by a single background thread, grouped
+# into transactions of up to max_batch statements or max_delay seconds. Each write runs inside a savepoint,
+# so a failing statement only fails its own future. Futures are resolved after the commit
+class SqlWriteQueue(object):
+    def __init__(self, engine, max_batch=1000, max_delay=0.01, max_pending=100000):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue(max_pending)  # Blocks producers while the writer is behind
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="pearsql-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Query, compiled template or plain SQL. The statement is built right away, so the query can be changed
+    # afterwards. Returns a concurrent.futures.Future of the row count
+    def submit(self, query, params=None):
+        if self._closed:
+            raise SqlException("Write queue is closed")
+
+        sql, params = _statement(query, params)
+        future = Future()
+        self._queue.put(_SqlWrite(query, sql, params, future))
+        return future
+
+    # Waits until all writes submitted so far are committed
+    def flush(self, timeout=None):
+        if self._closed:
+            return
+        future = Future()
+        self._queue.put(_SqlWrite(None, None, None, future))
+        future.result(timeout)
+
+    def close(self, wait=True):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            write = self._queue.get()
+            if write is _STOP:
+                break
+
+            batch = [write]
+            deadline = clock() + self.max_delay
+            while len(batch) < self.max_batch and write.sql is not None:  # Flushes end the batch
+                try:
+                    timeout = deadline - clock()
+                    write = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if write is _STOP:
+                    stop = True
+                    break
+                batch.append(write)
+            self._write(batch)
+
+        while True:  # Writes submitted concurrently to close()
+            try:
+                write = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if write is not _STOP and write.future.set_running_or_notify_cancel():
+                write.future.set_exception(SqlException("Write queue is closed"))
+
+    def _write(self, batch):
+        writes = [w for w in batch if w.future.set_running_or_notify_cancel()]
+        results = []
+        try:
+            with self.engine.transaction() as conn:
+                for group in _groups(w for w in writes if w.sql is not None):
+                    results.extend(self._execute(conn, group))
+        except BaseException as e:
+            for w in writes:
+                w.future.set_exception(e)
+            return
+
+        for future, result, exception in results:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        for w in writes:
+            if w.sql is None:
+                w.future.set_result(None)
+
+    # (future, row count, exception) of each write of the group
+    def _execute(self, conn, group):
+        first = group[0]
+        start = clock() if _hooks else None
+        conn.execute("SAVEPOINT pearsql_write")
+        try:
+            if len(group) == 1:
+                rowcount = self.engine._execute_statement(conn, first.query, first.sql, first.params).rowcount
+            else:
+                rowcount = conn.executemany(first.sql, [w.params for w in group]).rowcount
+        except Exception as e:
+            conn.execute("ROLLBACK TO pearsql_write")
+            conn.execute("RELEASE pearsql_write")
+            if len(group) > 1:  # Find the failing inserts
+                return [r for w in group for r in self._execute(conn, [w])]
+            return [(first.future, None, e)]
+        conn.execute("RELEASE pearsql_write")
+
+        if start is not None:
+            _notify("execute", first.query, first.sql, first.params if len(group) == 1 else None,
+                    clock() - start, rowcount, conn)
+        if self.engine.cache is not None:
+            self.engine._invalidate(conn, first.query)
+        if len(group) == 1:
+            return [(first.future, rowcount, None)]
+        return [(w.future, 1, None) for w in group]
@@ -28,4 +28,7 @@ setup(name='pearsql',
       install_requires=[
           'six',
       ],
+      extras_require={
+          'numpy': ['numpy'],
+      },
       zip_safe=False)
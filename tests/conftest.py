@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pearsql.engine import SqlEngine  # noqa: E402
+
+
+@pytest.fixture
+def database(tmpdir):
+    return str(tmpdir.join("test.db"))
+
+
+# Engine on a database file with 50 books (id 1-50, years 1990-1999)
+@pytest.fixture
+def engine(database):
+    engine = SqlEngine(database)
+    engine.execute("CREATE TABLE book (id INTEGER PRIMARY KEY, title TEXT, year INTEGER, author_id INTEGER)")
+    engine.execute("CREATE TABLE author (id INTEGER PRIMARY KEY, name TEXT)")
+    engine.executemany("INSERT INTO author (id, name) VALUES (?, ?)", [(i, "author %i" % i) for i in range(1, 6)])
+    engine.executemany("INSERT INTO book (id, title, year, author_id) VALUES (?, ?, ?, ?)",
+                       [(i, "book %i" % i, 1990 + i % 10, 1 + i % 5) for i in range(1, 51)])
+    yield engine
+    engine.close()
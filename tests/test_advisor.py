@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+from pearsql import D, Q, SqlException
+from pearsql.advisor import SqlIndexAdvisor
+from pearsql.schema import SqlSchema
+
+JOIN = Q.select(D.book).join(D.author, D.author.id == D.book.author_id).where(D.author.name == "author 1")
+
+
+def _names(advisor, *queries):
+    for query in queries:
+        advisor.record(query)
+    return [a.name for a in advisor.advise()]
+
+
+@pytest.mark.parametrize("with_schema", [False, True])
+def test_join_and_filter(engine, with_schema):
+    advisor = SqlIndexAdvisor(SqlSchema.load(engine) if with_schema else None)
+    names = _names(advisor, JOIN)
+    assert "idx_author_name" in names and "idx_author_id_name" not in names
+    # The INTEGER PRIMARY KEY is only known from the schema
+    assert ("idx_author_id" in names) != with_schema
+
+
+def test_rowid_dropped(engine):
+    advisor = SqlIndexAdvisor(SqlSchema.load(engine))
+    names = _names(advisor, Q.select(D.book).where(D.book.id == 3, D.book.year == 1995),
+                   Q.select(D.book).where(D.book.rowid > 3),
+                   Q.select(D.book).orderby(D.book.id))
+    assert names == ["idx_book_year"]
+
+    # Without a schema only the rowid names are known
+    assert _names(SqlIndexAdvisor(), Q.select(D.author).where(D.author.rowid == 3, D.author.name == "x")) == \
+        ["idx_author_name"]
+
+
+def test_sort_tail(engine):
+    advisor = SqlIndexAdvisor(SqlSchema.load(engine))
+    names = _names(advisor, Q.select(D.book).where(D.book.author_id == 1).orderby(D.book.year).orderby(D.book.id)
+                   .orderby(D.book.title))
+    assert names == ["idx_book_author_id_year"]
+
+
+def test_served(engine):
+    engine.execute("CREATE INDEX book_year_title ON book (year, title)")
+    advisor = SqlIndexAdvisor(SqlSchema.load(engine))
+    assert _names(advisor, Q.select(D.book).where(D.book.year == 1995)) == []
+    assert _names(advisor, Q.select(D.book).where(D.book.title == "x")) == ["idx_book_title"]
+
+
+def test_merged(engine):
+    advisor = SqlIndexAdvisor(SqlSchema.load(engine))
+    advisor.record(Q.select(D.book).where(D.book.author_id == 1), 3)
+    advisor.record(Q.select(D.book).where(D.book.author_id == 1, D.book.year > 1995))
+    advices = advisor.advise()
+    assert [a.name for a in advices] == ["idx_book_author_id_year"]
+    assert len(advices[0].queries) == 2
+
+
+def test_verify(engine):
+    advisor = SqlIndexAdvisor(SqlSchema.load(engine))
+    advisor.record(JOIN)
+    advisor.record(Q.select(D.book).where(D.book.year == 1995))
+    advices = advisor.verify(engine)
+    assert advices and all(a.verified is not None for a in advices)
+    assert [a.verified for a in advices if a.name == "idx_book_year"] == [True]
+    assert engine.schema(refresh=True).table_info("book").indexes == []  # Created on the copy only
+
+
+def test_verify_transaction(database, engine):
+    advisor = SqlIndexAdvisor()
+    advisor.record(Q.select(D.book).where(D.book.year == 1995))
+    connection = sqlite3.connect(database)
+    try:
+        connection.execute("INSERT INTO author (name) VALUES ('x')")
+        with pytest.raises(SqlException):
+            advisor.verify(connection)
+        connection.commit()
+        assert advisor.verify(connection)[0].verified
+    finally:
+        connection.close()
+
+    with engine.transaction():
+        engine.execute("INSERT INTO author (name) VALUES ('y')")
+        with pytest.raises(SqlException):
+            advisor.verify(engine)
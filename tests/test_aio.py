@@ -0,0 +1,115 @@
+# Async engine, run with asyncio.run(). Each test runs under a timeout, as the failures are hangs
+import asyncio
+
+import pytest
+
+from pearsql import D, Q
+from pearsql.aio import SqlAsyncEngine
+
+
+def _run(coroutine, timeout=10):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout))
+
+
+@pytest.fixture(params=["file", "memory"])
+def async_engine(request, engine, database):
+    if request.param == "file":
+        return SqlAsyncEngine(database)
+
+    memory = SqlAsyncEngine(":memory:")
+    memory.engine.execute("CREATE TABLE book (id INTEGER PRIMARY KEY, title TEXT, year INTEGER, author_id INTEGER)")
+    memory.engine.executemany("INSERT INTO book (id, title, year, author_id) VALUES (?, ?, ?, ?)",
+                              engine.fetchall("SELECT id, title, year, author_id FROM book"))
+    return memory
+
+
+def test_fetch(async_engine):
+    async def main():
+        async with async_engine:
+            rows = await Q.select(D.book).where(D.book.year == 1995).fetchall(async_engine)
+            one = await Q.select(D.book).columns(D.book.title).where(D.book.id == 7).fetchone(async_engine)
+            await async_engine.executemany("INSERT INTO book (title) VALUES (?)", [("x",), ("y",)])
+            count = await async_engine.fetchone("SELECT COUNT(*) FROM book")
+            return rows, one, count
+
+    rows, one, count = _run(main())
+    assert len(rows) == 5
+    assert one[0] == "book 7"
+    assert count[0] == 52
+
+
+def test_stream(async_engine):
+    async def main():
+        async with async_engine:
+            query = Q.select(D.book).columns(D.book.id, D.book.title).orderby(D.book.id)
+            return [row async for row in query.stream(async_engine, batch_size=7)]
+
+    rows = _run(main())
+    assert [row.id for row in rows] == list(range(1, 51))
+    assert rows[2].title == "book 3"
+
+
+def test_stream_error(async_engine):
+    async def main():
+        async with async_engine:
+            async for _ in async_engine.stream("SELECT * FROM missing"):
+                pass
+
+    with pytest.raises(Exception):
+        _run(main())
+
+
+# Leaving the async for and closing the engine before the stream is finalized
+def test_stream_break_close(async_engine):
+    async def main():
+        query = Q.select(D.book).orderby(D.book.id)
+        rows = query.stream(async_engine, batch_size=2, prefetch=1)
+        async for row in rows:
+            if row.id == 3:
+                break
+        await async_engine.close()
+        await rows.aclose()
+        return row.id
+
+    assert _run(main()) == 3
+
+
+def test_stream_break(async_engine):
+    async def main():
+        async with async_engine:
+            for _ in range(10):  # Leaks a connection or a worker per stream otherwise
+                rows = async_engine.stream("SELECT id FROM book", batch_size=1)
+                async for _ in rows:
+                    break
+                await rows.aclose()
+            return await async_engine.fetchone("SELECT COUNT(*) FROM book")
+
+    assert _run(main())[0] == 50
+
+
+# Awaiting calls in the async for, with a single pooled connection for ':memory:'
+def test_stream_nested(async_engine):
+    async def main():
+        async with async_engine:
+            titles = []
+            async for row in async_engine.stream("SELECT id FROM book ORDER BY id", batch_size=4):
+                title = await async_engine.fetchone("SELECT title FROM book WHERE id = ?", (row[0],))
+                titles.append(title[0])
+            return titles
+
+    assert _run(main()) == ["book %i" % i for i in range(1, 51)]
+
+
+def test_streams_interleaved(async_engine):
+    async def main():
+        async with async_engine:
+            first = async_engine.stream("SELECT id FROM book ORDER BY id", batch_size=3)
+            second = async_engine.stream("SELECT id FROM book ORDER BY id DESC", batch_size=5)
+            pairs = []
+            async for row in first:
+                pairs.append((row[0], (await second.__anext__())[0]))
+            await second.aclose()
+            return pairs
+
+    pairs = _run(main())
+    assert pairs[0] == (1, 50) and pairs[-1] == (50, 1)
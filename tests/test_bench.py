@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pearsql import bench  # noqa: E402
+from pearsql.builder import SqlQuery  # noqa: E402
+
+
+# Smoke run of every benchmark, also with immutable queries, whose builder calls return new queries
+@pytest.mark.parametrize("immutable", [False, True])
+def test_run(immutable):
+    old, SqlQuery.IMMUTABLE = SqlQuery.IMMUTABLE, immutable
+    try:
+        results = bench.run(repeat=1, min_time=0.0, out=None)
+        sqls = [bench.wide_select().build(), bench.many_joins().build()]
+    finally:
+        SqlQuery.IMMUTABLE = old
+    assert sorted(results) == sorted(name for name, _ in bench.BENCHMARKS)
+    assert all(r["ops"] > 0 and r["peak"] > 0 for r in results.values())
+    assert "GROUP BY" in sqls[0] and sqls[1].count("LEFT OUTER JOIN") == 29
+
+
+def test_compare(tmpdir):
+    path = str(tmpdir.join("baseline.json"))
+    bench.save({"a": {"ops": 100.0, "peak": 1}, "b": {"ops": 100.0, "peak": 1}}, path)
+    results = {"a": {"ops": 85.0, "peak": 1}, "b": {"ops": 70.0, "peak": 1}, "c": {"ops": 1.0, "peak": 1}}
+    assert bench.compare(results, bench.load(path), 0.2) == [("b", 100.0, 70.0)]
+    assert bench.main(["deep_and_or", "--repeat", "1", "--min-time", "0", "--compare", path]) == 0
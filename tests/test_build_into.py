@@ -0,0 +1,72 @@
+import io
+import socket
+
+from pearsql import D, Q, SqlException
+from pearsql.builder import SqlQuery
+import pytest
+
+
+def _large_query():
+    query = Q.select(D.t).columns(D.t.id).where(D.t.id == 0)
+    for i in range(20):
+        query = Q.select(D.t).columns(D.t.id).where(D.t.id.in_(query) & (D.t.name == "x" * 1000 + str(i)))
+    return query.union_all(*[Q.select(D.t).columns(D.t.id).where(D.t.name == "y" * 1000 + str(i))
+                             for i in range(200)])
+
+
+@pytest.mark.parametrize("beautiful", [False, True])
+def test_build_into(beautiful):
+    query = _large_query()
+    out = io.StringIO()
+    query.build_into(out, beautiful, chunk_size=1000)
+    assert out.getvalue() == query.build(beautiful)
+
+    chunks = []
+    query.build_into(chunks.append, beautiful, chunk_size=1000)
+    assert all(len(c) >= 1000 for c in chunks[:-1]) and len(chunks) > 100
+
+
+def test_build_into_params():
+    query = Q.select(D.t).where(D.t.name.in_(["a", "b"]), D.t.id.in_(Q.select(D.u).columns(D.u.id).where(D.u.x > 3)))
+    params = []
+    out = io.StringIO()
+    query.build_into(out, params=params)
+    assert (out.getvalue(), tuple(params)) == query.build_params()
+
+
+def test_build_into_socket():
+    query = Q.select(D.t).where(D.t.name == u"é")
+    a, b = socket.socketpair()
+    try:
+        query.build_into(a)
+        a.close()
+        assert b.recv(1000).decode("utf-8") == query.build()
+    finally:
+        b.close()
+    with pytest.raises(SqlException):
+        query.build_into(object())
+
+
+@pytest.mark.parametrize("beautiful", [False, True])
+def test_iter_build(beautiful):
+    query = _large_query()
+    chunks = list(query.iter_build(beautiful, chunk_size=1000))
+    assert "".join(chunks) == query.build(beautiful)
+    assert all(len(c) >= 1000 for c in chunks[:-1])
+
+
+# Nested queries and unions are only rendered when the generator reaches them
+def test_iter_build_lazy(monkeypatch):
+    rendered = []
+    render_into = SqlQuery._render_into
+
+    def count(self, *args):
+        rendered.append(self)
+        return render_into(self, *args)
+    monkeypatch.setattr(SqlQuery, "_render_into", count)
+
+    chunks = _large_query().iter_build(chunk_size=1000)
+    next(chunks)
+    assert len(rendered) <= 22  # The nested IN subqueries, not the 200 unions
+    assert len("".join(chunks)) > 200000
+    assert len(rendered) == 221
@@ -0,0 +1,139 @@
+import pytest
+
+from pearsql import D, Q
+from pearsql import cache as cache_module
+from pearsql.cache import SqlResultCache
+from pearsql.engine import SqlEngine
+
+
+def _put(cache, key, tables, rows=((1,),)):
+    cache.put(key, tables, cache.snapshot(tables), rows)
+
+
+def test_lru():
+    cache = SqlResultCache(max_entries=2)
+    _put(cache, "a", ("book",))
+    _put(cache, "b", ("book",))
+    assert cache.get("a") is not None  # b is now the least recently used
+    _put(cache, "c", ("author",))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_max_bytes():
+    rows = tuple((i, "x" * 100) for i in range(10))
+    size = cache_module._size(rows)
+    cache = SqlResultCache(max_bytes=int(size * 2.5))
+    for key in "abc":
+        _put(cache, key, ("book",), rows)
+    assert len(cache) == 2 and cache.get("a") is None
+
+    _put(cache, "big", ("book",), rows * 3)  # Larger than the cache
+    assert cache.get("big") is None
+
+
+def test_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module, "_clock", lambda: now[0])
+    cache = SqlResultCache(ttl=10)
+    _put(cache, "a", ("book",))
+    now[0] = 109.0
+    assert cache.get("a") is not None
+    now[0] = 111.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_invalidate():
+    cache = SqlResultCache()
+    _put(cache, "a", ("book",))
+    _put(cache, "b", ("author", "book"))
+    _put(cache, "c", ("author",))
+    cache.invalidate(["BOOK"])
+    assert cache.get("a") is None and cache.get("b") is None
+    assert cache.get("c") is not None
+
+
+# Results read before a write of their tables are not stored
+def test_stale_put():
+    cache = SqlResultCache()
+    snapshot = cache.snapshot(("book",))
+    cache.invalidate(["book"])
+    cache.put("a", ("book",), snapshot, ((1,),))
+    assert cache.get("a") is None
+
+    snapshot = cache.snapshot(("author",))
+    cache.clear()
+    cache.put("b", ("author",), snapshot, ((1,),))
+    assert cache.get("b") is None
+
+
+@pytest.fixture
+def cached(engine, database):
+    engine.close()
+    cached = SqlEngine(database, cache=SqlResultCache())
+    yield cached
+    cached.close()
+
+
+def _count(engine, query):
+    before = engine.cache.hits
+    rows = query.fetchall(engine)
+    return rows, engine.cache.hits - before
+
+
+def test_hit(cached):
+    query = Q.select(D.book).where(D.book.year == 1995)
+    rows, hits = _count(cached, query)
+    assert len(rows) == 5 and hits == 0
+    rows, hits = _count(cached, Q.select(D.book).where(D.book.year == 1995))  # Same structure
+    assert len(rows) == 5 and hits == 1
+    assert Q.select(D.book).columns(D.book.title).where(D.book.id == 1).fetchone(cached)[0] == "book 1"
+
+
+def test_query_write(cached):
+    books = Q.select(D.book).where(D.book.year == 1995)
+    authors = Q.select(D.author)
+    books.fetchall(cached)
+    authors.fetchall(cached)
+    Q.update(D.book).columns(D.book.year.set(1995)).where(D.book.id == 1).execute(cached)
+    rows, hits = _count(cached, books)
+    assert len(rows) == 6 and hits == 0
+    assert _count(cached, authors)[1] == 1
+
+
+@pytest.mark.parametrize("sql", ["DELETE FROM book WHERE id = 1",
+                                 "WITH old AS (SELECT id FROM book WHERE year < 1991) DELETE FROM book WHERE id IN old"])
+def test_plain_write(cached, sql):
+    books = Q.select(D.book)
+    authors = Q.select(D.author)
+    books.fetchall(cached)
+    authors.fetchall(cached)
+    cached.execute(sql)
+    rows, hits = _count(cached, books)
+    assert len(rows) < 50 and hits == 0
+    assert _count(cached, authors)[1] == 0
+
+
+@pytest.mark.parametrize("read", [
+    lambda engine: Q.select(D.author).explain(engine),
+    lambda engine: engine.schema(refresh=True),
+    lambda engine: engine.fetchall("SELECT COUNT(*) FROM author"),
+    lambda engine: engine.fetchall("  with a AS (SELECT 1) SELECT * FROM a"),
+    lambda engine: engine.execute("PRAGMA user_version"),
+])
+def test_plain_read(cached, read):
+    books = Q.select(D.book)
+    books.fetchall(cached)
+    read(cached)
+    assert _count(cached, books)[1] == 1
+
+
+# Temporary tables are per connection, so their results are never shared
+def test_temp_values(cached):
+    for values in ([1, 2], [3, 4, 5]):
+        with cached.temp_values(values) as table:
+            rows, hits = _count(cached, Q.select(D.book).where(D.book.id.in_(table)))
+            assert sorted(r[0] for r in rows) == values and hits == 0
+    assert len(cached.cache) == 0
@@ -0,0 +1,48 @@
+import array
+
+import pytest
+
+from pearsql import D, Q, SqlException
+
+
+@pytest.fixture
+def measurements(engine):
+    engine.execute("CREATE TABLE m (id INTEGER PRIMARY KEY, v REAL, n INTEGER, label TEXT, x)")
+    engine.executemany("INSERT INTO m VALUES (?, ?, ?, ?, ?)",
+                       [(i, i / 2.0, None if i == 3 else i * 10, "m%i" % i, i) for i in range(1, 8)])
+    return engine
+
+
+def test_types(measurements):
+    columns = Q.select(D.m).columns(D.m.id, D.m.v, D.m.n.as_("count"), D.m.label, D.m.x).fetch_columns(measurements)
+    assert list(columns) == ["id", "v", "count", "label", "x"]
+    assert columns["id"] == array.array("q", range(1, 8))
+    assert columns["v"].typecode == "d" and list(columns["v"]) == [i / 2.0 for i in range(1, 8)]
+    assert columns["count"].typecode == "d" and columns["count"][2] != columns["count"][2]  # NULL as NaN
+    assert columns["label"] == ["m%i" % i for i in range(1, 8)]
+    assert columns["x"] == list(range(1, 8))  # No declared type: Python objects
+
+
+# Same named columns of different tables keep their own values, named like stream() rows
+def test_duplicate_names(engine):
+    query = Q.select(D.book).columns(D.book.id, D.author.id, D.book.title).join(
+        D.author, D.author.id == D.book.author_id).orderby(D.book.id).limit(3)
+    columns = engine.fetch_columns(query)
+    rows = list(engine.stream(query))
+    assert list(columns) == list(rows[0]._fields) == ["id", "_1", "title"]
+    assert list(columns["id"]) == [1, 2, 3]
+    assert list(columns["_1"]) == [2, 3, 4]
+    assert columns["title"] == ["book 1", "book 2", "book 3"]
+
+
+def test_numpy(measurements):
+    numpy = pytest.importorskip("numpy")
+    columns = Q.select(D.m).columns(D.m.id, D.m.v, D.m.label).fetch_columns(measurements, numpy=True)
+    assert columns["id"].dtype == numpy.int64 and columns["id"].sum() == 28
+    assert columns["v"].dtype == numpy.float64
+    assert columns["label"].dtype == object
+
+
+def test_needs_columns(engine):
+    with pytest.raises(SqlException):
+        engine.fetch_columns(Q.select(D.book))
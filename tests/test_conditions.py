@@ -0,0 +1,43 @@
+import time
+
+from pearsql import D, Q
+
+
+def test_chain_linear():
+    start = time.time()
+    condition = D.item.id == 0
+    for i in range(1, 50000):
+        condition = condition | (D.item.id == i)
+    assert time.time() - start < 5.0
+    assert condition._op2 == 50000
+    sql = Q.select(D.item).where(condition).build()
+    assert sql.count(" OR ") == 49999 and sql.count("((") == 1
+
+
+def test_derived_conditions_unchanged():
+    base = (D.a.x == 1) | (D.a.y == 2)
+    derived = [base | (D.a.z == i) for i in range(1000)]
+    assert len(base._op1) <= 3 and base._op2 == 2
+    assert Q.select(D.a).where(base).build() == 'SELECT * FROM "a" WHERE (("a"."x" = 1) OR ("a"."y" = 2)) ;'
+    for i in (0, 1, 999):
+        assert Q.select(D.a).where(derived[i]).build() == \
+            'SELECT * FROM "a" WHERE (("a"."x" = 1) OR ("a"."y" = 2) OR ("a"."z" = %i)) ;' % i
+
+
+def test_flatten_right():
+    condition = (D.a.x == 1) & ((D.a.y == 2) & (D.a.z == 3))
+    assert Q.select(D.a).where(condition).build() == \
+        'SELECT * FROM "a" WHERE (("a"."x" = 1) AND ("a"."y" = 2) AND ("a"."z" = 3)) ;'
+    mixed = ((D.a.x == 1) | (D.a.y == 2)) & (D.a.z == 3)
+    assert Q.select(D.a).where(mixed).build() == \
+        'SELECT * FROM "a" WHERE ((("a"."x" = 1) OR ("a"."y" = 2)) AND ("a"."z" = 3)) ;'
+
+
+def test_deep_nesting():
+    condition = D.a.x == 0
+    for i in range(1, 5000):
+        condition = (condition & (D.a.x == i)) if i % 2 else (condition | (D.a.y == i))
+    query = Q.select(D.a).where(condition)
+    assert query.build().count("(") > 5000
+    assert query.structural_key() == Q.select(D.a).where(condition).structural_key()
+    assert query.compile().sql == query.build_params()[0]
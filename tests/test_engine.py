@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from pearsql import D, Q, SqlException
+from pearsql.engine import SqlEngine
+
+
+def test_fetch(engine):
+    assert engine.fetchone(Q.select(D.book).columns(D.book.title).where(D.book.id == 3)) == ("book 3",)
+    rows = engine.fetchall(Q.select(D.book).columns(D.book.id).where(D.book.year == 1995))
+    assert [r[0] for r in rows] == [5, 15, 25, 35, 45]
+    assert engine.fetchone(Q.select(D.book).where(D.book.id == 99)) is None
+
+
+def test_execute_params(engine):
+    assert engine.execute(Q.update(D.book).columns(D.book.title.set("x")).where(D.book.year == 1990)) == 5
+    assert engine.fetchone("SELECT count(*) FROM book WHERE title = ?", ("x",)) == (5,)
+
+
+def test_pragmas(engine):
+    assert engine.fetchone("PRAGMA journal_mode") == ("wal",)
+
+
+def test_nested_connection(engine):
+    with engine.connection() as outer:
+        with engine.connection() as inner:
+            assert inner is outer
+        assert engine._idle.qsize() == 0
+    assert engine._idle.qsize() == 1
+
+
+def test_pool_bound(database):
+    engine = SqlEngine(database, pool_size=1, timeout=0.1)
+    errors = []
+
+    def other():
+        try:
+            engine.fetchone("SELECT 1")
+        except SqlException as e:
+            errors.append(e)
+
+    with engine.connection():
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+    assert len(errors) == 1
+    assert engine.fetchone("SELECT 1") == (1,)
+    engine.close()
+
+
+def test_threads(engine):
+    results = []
+
+    def work(i):
+        results.append(engine.fetchone(Q.select(D.book).columns(D.book.id).where(D.book.id == i))[0])
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(1, 21)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == list(range(1, 21))
+    assert engine._created <= engine.pool_size
+
+
+# The stream's connection is reused by the calls of the same thread, also with a single pooled connection
+def test_stream_while_fetch(database, engine):
+    single = SqlEngine(database, pool_size=1, timeout=0.1)
+    count = 0
+    for row in single.stream(Q.select(D.book).columns(D.book.id), batch_size=7):
+        assert single.fetchone(Q.select(D.book).columns(D.book.id).where(D.book.id == row.id)) == (row.id,)
+        count += 1
+    assert count == 50
+    assert single._idle.qsize() == 1
+    single.close()
+
+
+def test_transaction(engine):
+    with engine.transaction():
+        engine.execute(Q.delete(D.book).where(D.book.id > 10))
+        with engine.transaction():  # Nested, part of the outer one
+            engine.execute(Q.delete(D.book).where(D.book.id > 5))
+    assert engine.fetchone("SELECT count(*) FROM book") == (5,)
+
+
+def test_transaction_rollback(engine):
+    with pytest.raises(ValueError):
+        with engine.transaction():
+            engine.execute(Q.delete(D.book))
+            raise ValueError()
+    assert engine.fetchone("SELECT count(*) FROM book") == (50,)
+    with engine.connection() as conn:
+        assert not conn.in_transaction
+
+
+def test_executemany(engine):
+    query = Q.insert(D.author).columns(D.author.id, D.author.name)
+    assert engine.executemany(query, [(10, "a"), (11, "b")]) == 2
+    assert engine.fetchone("SELECT count(*) FROM author") == (7,)
+
+
+def test_temp_values(engine):
+    with engine.temp_values([3, 4, 99]) as values:
+        rows = engine.fetchall(Q.select(D.book).columns(D.book.id).where(D.book.id.in_(values)).orderby(D.book.id))
+    assert rows == [(3,), (4,)]
+
+
+def test_close(engine):
+    engine.fetchone("SELECT 1")
+    engine.close()
+    with pytest.raises(SqlException):
+        engine.fetchone("SELECT 1")
@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+from pearsql import D, Q
+from pearsql.engine import SqlEngine
+from pearsql.explain import SqlPlan, SqlPlanException, SqlPlanWarning, check_plan, explain, plan_problems
+
+
+def test_plan_tree():
+    plan = SqlPlan("SELECT ...", [(2, 0, 0, "SCAN book"), (5, 2, 0, "SEARCH author USING INTEGER PRIMARY KEY"),
+                                  (9, 0, 0, "USE TEMP B-TREE FOR ORDER BY")])
+    assert [n.detail for n in plan.roots] == ["SCAN book", "USE TEMP B-TREE FOR ORDER BY"]
+    assert plan.roots[0].children[0].detail.startswith("SEARCH author")
+    assert [n.scanned_table for n in plan.full_scans()] == ["book"]
+    assert [n.temp_btree for n in plan.temp_btrees()] == ["ORDER BY"]
+    assert str(plan) == "SCAN book\n  SEARCH author USING INTEGER PRIMARY KEY\nUSE TEMP B-TREE FOR ORDER BY"
+
+
+@pytest.mark.parametrize("detail, table", [("SCAN TABLE book", "book"), ("SCAN b", "b"),
+                                           ("SCAN book USING COVERING INDEX idx", None),
+                                           ("SCAN CONSTANT ROW", None), ("SCAN (subquery-1)", None),
+                                           ("SEARCH book USING INDEX idx (year=?)", None)])
+def test_scanned_table(detail, table):
+    assert SqlPlan("", [(1, 0, 0, detail)]).nodes[0].scanned_table == table
+
+
+def test_explain(engine):
+    plan = Q.select(D.book).where(D.book.id == 3).explain(engine)
+    assert plan.full_scans() == [] and "SEARCH" in plan.nodes[0].detail
+
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE t (x)")
+    plan = explain(Q.select(D.t).where(D.t.x == 1), connection)
+    assert [n.scanned_table for n in plan.full_scans()] == ["t"]
+    connection.close()
+
+
+# Plans follow the indexes created by other connections after the connection planned the statement
+def test_explain_schema_change(database, engine):
+    connection = sqlite3.connect(database)
+    query = Q.select(D.book).where(D.book.year == 1995)
+    assert explain(query, connection).full_scans()
+    engine.execute("CREATE INDEX book_year ON book (year)")
+    assert not explain(query, connection).full_scans()
+    connection.close()
+
+
+def test_problems(engine):
+    query = Q.select(D.book.as_("b")).join(D.author, D.author.id == D.book.author_id).where(
+        D.book.year == 1995).orderby(D.author.name)
+    problems = plan_problems(query, query.explain(engine))
+    assert ("full scan of table 'book'", ["book.year"]) in problems
+    assert ("temporary B-tree for ORDER BY", ["author.name"]) in problems
+
+
+def test_check_plan(engine):
+    query = Q.select(D.book).where(D.book.year == 1995)
+    with pytest.raises(SqlPlanException) as e:
+        check_plan(query, query.explain(engine))
+    assert "book.year" in str(e.value)
+    with pytest.warns(SqlPlanWarning):
+        check_plan(query, query.explain(engine), "warn")
+
+    indexed = Q.select(D.book).where(D.book.id == 3)
+    plan = indexed.explain(engine)
+    assert check_plan(indexed, plan) is plan
+
+
+# Checked once per distinct statement, inserts are not checked
+def test_engine_explain(database, engine):
+    strict = SqlEngine(database, explain="raise")
+    with pytest.raises(SqlPlanException):
+        strict.fetchall(Q.select(D.book).where(D.book.year == 1995))
+    assert strict.fetchone(Q.select(D.book).columns(D.book.title).where(D.book.id == 3)) == ("book 3",)
+    strict.execute(Q.insert(D.author).columns(D.author.name.set("x")))
+
+    engine.execute("CREATE INDEX book_year ON book (year)")
+    assert len(strict.fetchall(Q.select(D.book).where(D.book.year == 1995))) == 5
+    strict.close()
+
+    warning = SqlEngine(database, explain="warn")
+    with pytest.warns(SqlPlanWarning):
+        warning.fetchall(Q.select(D.author).where(D.author.name == "x"))
+    warning.fetchall(Q.select(D.author).where(D.author.name == "x"))  # Warned once
+    assert len(warning._explained) == 1
+    warning.close()
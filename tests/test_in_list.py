@@ -0,0 +1,25 @@
+from pearsql import D, Q
+
+
+def test_default_off():
+    assert Q.IN_LIST_THRESHOLD is None
+    sql = Q.select(D.book).where(D.book.id.in_(range(600))).build()
+    assert "json_each" not in sql and sql.count(", ") == 599
+
+
+def test_json_list(engine):
+    query = Q.select(D.book).columns(D.book.id).where(D.book.id.in_(range(0, 100, 7))).orderby(D.book.id)
+    expected = [(i,) for i in range(7, 50, 7)]
+    assert engine.fetchall(query) == expected
+
+    query = query.in_list_threshold(5)
+    sql, params = query.build_params()
+    assert "json_each(?)" in sql and len(params) == 1
+    assert "json_each('[0,7," in query.build()
+    assert engine.fetchall(query) == expected
+
+
+def test_json_list_fallback():
+    # Values JSON can't represent exactly are bound one by one
+    sql, params = Q.select(D.book).where(D.book.id.in_([b"x"] * 10)).in_list_threshold(5).build_params()
+    assert "json_each" not in sql and len(params) == 10
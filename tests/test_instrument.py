@@ -0,0 +1,104 @@
+import logging
+
+import pytest
+
+from pearsql import D, Q
+from pearsql.instrument import SqlEvent, SqlStats, SlowQueryLog, add_hook, fingerprint, remove_hook
+
+
+@pytest.fixture
+def hook():
+    hooks = []
+
+    def register(h):
+        hooks.append(add_hook(h))
+        return h
+
+    yield register
+    for h in hooks:
+        remove_hook(h)
+
+
+def test_events(engine, hook):
+    recorded = []
+    hook(recorded.append)
+    query = Q.select(D.book).where(D.book.year == 1995)
+    query.build()
+    rows = engine.fetchall(query)
+    assert [(e.kind, e.sql) for e in recorded] == [
+        ("build", 'SELECT * FROM "book" WHERE ("book"."year" = 1995) ;'),
+        ("build", 'SELECT * FROM "book" WHERE ("book"."year" = ?) ;'),
+        ("execute", 'SELECT * FROM "book" WHERE ("book"."year" = ?) ;')]
+
+    execute = recorded[-1]
+    assert execute.query is query and execute.params == (1995,)
+    assert execute.rows == len(rows) == 5
+    assert execute.seconds >= 0 and execute.connection is not None
+    assert execute.fingerprint == 'SELECT * FROM "book" WHERE ("book"."year" = ?) ;'
+
+
+def test_remove_hook(engine):
+    recorded = []
+    add_hook(recorded.append)
+    remove_hook(recorded.append)
+    engine.fetchall(Q.select(D.book))
+    assert recorded == []
+
+
+def test_stream_rows(engine, hook):
+    recorded = []
+    hook(recorded.append)
+    assert len(list(Q.select(D.book).stream(engine, batch_size=7))) == 50
+    assert [e.rows for e in recorded if e.kind == "execute"] == [50]
+    engine.execute(Q.update(D.book).columns(D.book.title.set("x")).where(D.book.year == 1990))
+    assert recorded[-1].rows == 5
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM t WHERE a = 1 AND b = 'x''y'", "SELECT * FROM t WHERE a = ? AND b = ?"),
+    ("SELECT * FROM t WHERE a IN (1, 2, 3)", "SELECT * FROM t WHERE a IN (?, ...)"),
+    ("SELECT * FROM t WHERE a IN (?,?)  AND\n b > -2.5e3", "SELECT * FROM t WHERE a IN (?, ...) AND b > ?"),
+    ("SELECT t1.x2 FROM \"t1\" WHERE c = :name", "SELECT t1.x2 FROM \"t1\" WHERE c = ?"),
+])
+def test_fingerprint(sql, expected):
+    assert fingerprint(sql) == expected
+
+
+def test_stats(engine, hook):
+    stats = hook(SqlStats())
+    for i in range(1, 11):
+        engine.fetchone(Q.select(D.book).where(D.book.id == i))
+    engine.fetchall(Q.select(D.author))
+    report = stats.report()
+    assert len(report) == 2
+    by_id = [r for r in report if "WHERE" in r["fingerprint"]][0]
+    assert by_id["count"] == 10 and by_id["rows"] == 10
+    assert by_id["p50"] <= by_id["p99"] and by_id["total"] >= by_id["p99"]
+    stats.reset()
+    assert stats.report() == []
+
+
+def test_stats_samples():
+    stats = SqlStats(samples=3)
+    for seconds in (5.0, 1.0, 2.0, 3.0, 4.0):
+        stats(SqlEvent("execute", None, "SELECT 1", None, seconds, 1))
+    stats(SqlEvent("build", None, "SELECT 1", None, 100.0))
+    report = stats.report()[0]
+    assert report["count"] == 5 and report["total"] == 15.0
+    assert (report["p50"], report["p99"]) == (3.0, 4.0)  # Over the last 3 executions: 2, 3, 4
+
+
+def test_slow_log(engine, hook, caplog):
+    hook(SlowQueryLog(threshold=0))
+    with caplog.at_level(logging.WARNING, logger="pearsql.slow"):
+        engine.fetchall(Q.select(D.book).where(D.book.year == 1995))
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert "Slow query" in message and "5 rows" in message and "SCAN book" in message
+
+
+def test_slow_log_threshold(engine, hook, caplog):
+    hook(SlowQueryLog(threshold=60, explain=False))
+    with caplog.at_level(logging.WARNING, logger="pearsql.slow"):
+        engine.fetchall(Q.select(D.book))
+    assert caplog.records == []
@@ -0,0 +1,54 @@
+import pytest
+
+from pearsql import D, Q, SqlException
+
+
+@pytest.fixture
+def pairs(engine):
+    engine.execute("CREATE TABLE a (id INTEGER PRIMARY KEY, g INTEGER)")
+    engine.execute("CREATE TABLE b (id INTEGER PRIMARY KEY, a_id INTEGER)")
+    engine.executemany("INSERT INTO a VALUES (?, ?)", [(i, i % 3) for i in range(1, 101)])
+    engine.executemany("INSERT INTO b VALUES (?, ?)", [(i, 1 + i % 4) for i in range(1, 11)])
+    return engine
+
+
+def _walk(engine, query, page_size):
+    return [row for page in query.paginate(engine, page_size) for row in page]
+
+
+def test_seek_after(pairs):
+    def query():
+        return Q.select(D.a).columns(D.a.id, D.a.g).orderby(D.a.g).desc().orderby(D.a.id)
+    assert pairs.fetchall(query().seek_after((1, 97)).limit(3)) == [(100, 1), (3, 0), (6, 0)]
+    row = list(pairs.stream(query().limit(2)))[-1]  # Named row, read by position
+    assert (row.id, row.g) == (5, 2)
+    assert pairs.fetchall(query().seek_after(row).limit(1)) == [(8, 2)]
+    assert pairs.fetchall(query().seek_after({"g": 2, "id": 98}).limit(1)) == [(1, 1)]
+    with pytest.raises(SqlException):
+        query().seek_after((1,))
+
+
+@pytest.mark.parametrize("desc", [False, True])
+def test_paginate_ties(pairs, desc):
+    query = Q.select(D.a).orderby(D.a.g)
+    if desc:
+        query = query.desc()
+    rows = _walk(pairs, query, 7)
+    assert len(rows) == 100 and len(set(rows)) == 100
+    assert [r.g for r in rows] == sorted([r.g for r in rows], reverse=desc)
+
+
+def test_paginate_join(pairs):
+    query = Q.select(D.a).columns(D.a.id, D.b.id).join(D.b, D.b.a_id == D.a.id)
+    expected = pairs.fetchall(query.orderby(D.a.id, D.b.id))
+    assert _walk(pairs, query.orderby(D.a.id, D.b.id), 3) == expected
+    mixed = query.orderby(D.b.id).desc().orderby(D.a.id)
+    assert _walk(pairs, mixed, 3) == pairs.fetchall(mixed)
+    assert len(expected) == 10
+
+
+def test_paginate_key_not_selected(pairs):
+    with pytest.raises(SqlException):
+        next(Q.select(D.a).columns(D.a.g).orderby(D.a.g).paginate(pairs, 10))
+    with pytest.raises(SqlException):
+        next(Q.select(D.a).orderby(D.a.g).offset(3).paginate(pairs, 10))
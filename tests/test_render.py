@@ -0,0 +1,175 @@
+# coding=utf-8
+# Differential test of the renderer: Handwritten and seeded random queries are built with the package and with the
+# builder as released before the rendering rewrite (legacy_builder.py), which have to render the same statements.
+# The only allowed difference are the parentheses of flattened AND/OR chains: ((a AND b) AND c) is (a AND b AND c)
+import random
+
+import pytest
+
+import legacy_builder
+from pearsql import D, Q, F
+
+LEGACY = legacy_builder.SqlDatabase, legacy_builder.SqlQuery, legacy_builder.SqlFunction
+PACKAGE = D, Q, F
+SEEDS = 500
+
+
+def _handwritten():
+    yield "select", lambda D, Q, F: (
+        Q.select(D.book.as_("b")).distinct()
+        .columns(D.book.title.as_("title"), D.author.name.as_("author_name"))
+        .join(D.author.as_("a"), D.author.id == D.book.author_id)
+        .left_join(D.pub, D.pub.id == D.book.pub_id)
+        .where(D.author.gender != 1)
+        .where(D.author.nation == "Germ'any")
+        .where((D.book.x < 3) | (D.book.y >= 4.5) & ~(D.book.z <= 2))
+        .where(D.book.year.between(1900, 2000), D.book.t.like("%a%"))
+        .where(D.book.id.in_([1, 2, "x"]), D.book.id.in_(Q.select(D.other).columns(D.other.id).where(D.other.v > 5)))
+        .having(F.count(D.author.publications) > 5)
+        .groupby(D.book.category, D.book.title)
+        .orderby(D.book.title).desc().orderby(D.book.year)
+        .limit(100)
+        .offset(50))
+    yield "union", lambda D, Q, F: Q.select(D.a).where(D.a.x == 1) + Q.select(D.b).where(D.b.y == "q")
+    yield "functions", lambda D, Q, F: Q.select(D.a).having(F.max(D.a.x) > 1, F.min(D.a.y) < 2,
+                                                            F.avg(D.a.z) == 3, F.sum(D.a.w) != 4)
+    yield "update", lambda D, Q, F: Q.update(D.author.as_("a")).columns(
+        D.author.name.set(u"Heinrich Böll"), D.author.n.set(3)).where(D.author.id == 27).limit(1)
+    yield "insert", lambda D, Q, F: Q.insert(D.author.as_("a")).columns(
+        D.author.name.set("Friedrich Schiller"), D.author.gender.set(F.default()))
+    yield "insert_default", lambda D, Q, F: Q.insert(D.author)
+    yield "insert_none", lambda D, Q, F: Q.insert(D.author).ignore_none().columns(D.author.name.set(None))
+    yield "delete", lambda D, Q, F: Q.delete(D.author.as_("a")).where(D.author.id == 27)
+    yield "joins", lambda D, Q, F: Q.select(D.a, D.b.as_("bb")).full_join(D.c, D.c.id == D.a.id).right_join(
+        D.d.as_("dd"), D.d.id == D.b.id).use_aliases(False)
+    yield "large_in", lambda D, Q, F: Q.select(D.a).where(D.a.x.in_(list(range(600))))
+
+
+# Random query of the seed, built with the mutating builder calls both builders share
+def _random_query(seed, D, Q, F):
+    r = random.Random(seed)
+    tables = ["a", "b", "c"]
+
+    def col():
+        return getattr(getattr(D, r.choice(tables)), r.choice(["x", "y", "z"]))
+
+    def lit():
+        return r.choice([1, 2.5, "s'q", "t", True, col()])
+
+    def cond(depth):
+        k = r.randint(0, 11 if depth < 4 else 7)
+        if k == 0:
+            return col() == lit()
+        elif k == 1:
+            return col() != lit()
+        elif k == 2:
+            return col() < lit()
+        elif k == 3:
+            return col().between(lit(), lit())
+        elif k == 4:
+            return col().like("%x%")
+        elif k == 5:
+            return col().in_([lit() for _ in range(r.randint(1, 4))])
+        elif k == 6:
+            return col().in_(list(range(r.randint(400, 700))))
+        elif k == 7:
+            return F.count(col()) >= 3
+        elif k == 8:
+            return cond(depth + 1) & cond(depth + 1)
+        elif k == 9:
+            return cond(depth + 1) | cond(depth + 1)
+        elif k == 10:
+            return ~cond(depth + 1)
+        return col().in_(select(depth + 1))
+
+    def select(depth):
+        q = Q.select(D.a.as_("aa") if r.random() < .5 else D.a)
+        if r.random() < .5:
+            q.columns(*[col().as_("c%i" % i) if r.random() < .5 else col() for i in range(r.randint(1, 3))])
+        if r.random() < .5:
+            q.join(D.b.as_("bb"), D.b.x == D.a.y)
+        for _ in range(r.randint(0, 3)):
+            q.where(cond(depth))
+        if r.random() < .3:
+            q.having(cond(depth))
+        if r.random() < .3:
+            q.groupby(col())
+        if r.random() < .3:
+            q.orderby(col())
+            if r.random() < .5:
+                q.desc()
+        if r.random() < .3:
+            q.limit(5).offset(2)
+        if r.random() < .2 and depth < 3:
+            q.union(select(depth + 1))
+        return q
+
+    Q.USE_QUOTES = r.random() < .5
+    k = r.randint(0, 3)
+    if k == 0:
+        return select(0)
+    elif k == 1:
+        return Q.update(D.a).columns(D.a.x.set(lit())).where(cond(0))
+    elif k == 2:
+        return Q.insert(D.a).columns(D.a.x.set(lit()), D.a.y.set(F.default()))
+    return Q.delete(D.a).where(cond(0)).limit(3)
+
+
+def _cases():
+    for name, make in _handwritten():
+        for quotes in (False, True):
+            yield "%s_%s" % (name, "quotes" if quotes else "plain"), make, quotes
+    for seed in range(SEEDS):
+        yield "random_%i" % seed, seed, None
+
+
+def _build(case, namespace):
+    _, make, quotes = case
+    Q = namespace[1]
+    try:
+        if quotes is None:
+            query = _random_query(make, *namespace)
+        else:
+            Q.USE_QUOTES = quotes
+            query = make(*namespace)
+        return query
+    finally:
+        Q.USE_QUOTES = True
+
+
+def _strip(sql):
+    return sql.replace("(", "").replace(")", "")
+
+
+def _literal(value):
+    if isinstance(value, str):
+        return "'%s'" % value.replace("'", "''")
+    return str(value)
+
+
+CASES = list(_cases())
+
+
+@pytest.mark.parametrize("case", CASES, ids=[c[0] for c in CASES])
+def test_render(case):
+    query, legacy = _build(case, PACKAGE), _build(case, LEGACY)
+    for beautiful in (False, True):
+        sql, expected = query.build(beautiful), legacy.build(beautiful)
+        if sql != expected:  # Flattened AND/OR chains
+            assert _strip(sql) == _strip(expected) and sql.count("(") < expected.count("(")
+
+        # Literals are bound in order of appearance
+        template, params = query.build_params(beautiful)
+        parts = template.split("?")
+        assert len(parts) == len(params) + 1
+        assert "".join(p + _literal(v) for p, v in zip(parts, params)) + parts[-1] == sql
+
+
+# Documented difference: IN lists above the threshold are bound as a JSON array, as one literal or parameter
+def test_in_list_threshold():
+    legacy = LEGACY[1].select(LEGACY[0].a).where(LEGACY[0].a.x.in_(list(range(600)))).build()
+    query = Q.select(D.a).where(D.a.x.in_(range(600)))
+    assert query.build() == legacy
+    json_list = "[%s]" % ",".join(str(i) for i in range(600))
+    assert query.in_list_threshold(500).build() == legacy.replace(
+        "(%s)" % ", ".join(str(i) for i in range(600)), "(SELECT value FROM json_each('%s'))" % json_list)
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+
+from pearsql import D, Q, SqlException
+from pearsql.schema import SqlSchema, SqlSchemaException
+
+
+@pytest.fixture
+def schema(engine):
+    engine.execute("CREATE INDEX book_year_title ON book (year, title)")
+    engine.execute("CREATE UNIQUE INDEX author_name ON author (name) WHERE name IS NOT NULL")
+    engine.execute("CREATE TABLE tag (name TEXT PRIMARY KEY, weight REAL NOT NULL DEFAULT 1)")
+    engine.execute("CREATE VIEW recent AS SELECT * FROM book WHERE year > 1995")
+    return SqlSchema.load(engine)
+
+
+def test_tables(schema):
+    assert schema.tables == ["author", "book", "recent", "tag"]
+    book = schema.table_info("BOOK")
+    assert list(book.columns) == ["id", "title", "year", "author_id"]
+    assert book.column("Year").type == "INTEGER"
+    assert schema.table_info("recent").view and not book.view
+
+    weight = schema.table_info("tag").column("weight")
+    assert weight.notnull and weight.default == "1"
+    with pytest.raises(SqlSchemaException):
+        schema.table_info("missing")
+
+
+def test_indexes(schema):
+    book = schema.table_info("book")
+    assert [(i.name, i.columns, i.unique, i.partial) for i in book.indexes] == \
+        [("book_year_title", ["year", "title"], False, False)]
+    assert [i.name for i in book.indexes_for("title", "year")] == ["book_year_title"]
+    assert book.indexes_for("title") == []
+    assert schema.table_info("author").indexes[0].partial
+    assert schema.table_info("author").indexes_for("name") == []
+
+
+def test_rowid(schema):
+    assert schema.table_info("book").rowid_column.name == "id"
+    assert schema.table_info("tag").rowid_column is None  # TEXT primary key
+    assert schema.is_indexed("book.id") and schema.is_indexed("book.rowid")
+    assert schema.is_indexed(D.book.year) and not schema.is_indexed(D.book.title)
+    assert schema.is_indexed("tag.name")  # Automatic index of the primary key
+    assert not schema.is_indexed("tag.weight")
+
+
+def test_nodes(schema, engine):
+    assert schema.book is schema.book
+    assert schema.book.as_("b") is schema.book.as_("b")
+    query = Q.select(schema.book.as_("b")).columns(schema.book.title).where(schema.book.id == 4)
+    assert query.build() == Q.select(D.book.as_("b")).columns(D.book.title).where(D.book.id == 4).build()
+    assert query.fetchone(engine) == ("book 4",)
+    assert schema.book.rowid.column == "rowid"
+
+    with pytest.raises(SqlSchemaException):
+        schema.missing
+    with pytest.raises(SqlSchemaException):
+        schema.book.missing
+    with pytest.raises(SqlException):  # Also a SqlException
+        schema.recent.rowid
+    assert not hasattr(schema.book, "missing")
+
+
+def test_engine_schema(engine):
+    schema = engine.schema()
+    assert engine.schema() is schema
+    engine.execute("CREATE TABLE extra (x)")
+    assert "extra" not in schema.tables
+    assert "extra" in engine.schema(refresh=True).tables
+
+
+def test_load_connection(database, engine):
+    connection = sqlite3.connect(database)
+    assert SqlSchema.load(connection).tables == ["author", "book"]
+    connection.close()
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from pearsql import D, Q, SqlException
+from pearsql.engine import SqlEngine
+from pearsql.shard import SqlShards
+
+
+# Three shard databases of a log table, and one database with all their rows to compare with
+@pytest.fixture
+def shards(tmpdir):
+    r = random.Random(1)
+    everything = SqlEngine(":memory:")
+    paths = []
+    for shard in range(3):
+        path = str(tmpdir.join("shard%i.db" % shard))
+        engine = SqlEngine(path)
+        rows = [(shard * 1000 + i, r.choice([None, r.random(), r.randint(0, 5)]), r.choice(["x", "y", "z"]))
+                for i in range(300)]
+        for e in (engine, everything):
+            e.execute("CREATE TABLE IF NOT EXISTS log (id INTEGER PRIMARY KEY, v REAL, s TEXT)")
+            e.executemany("INSERT INTO log (id, v, s) VALUES (?, ?, ?)", rows)
+        engine.close()
+        paths.append(path)
+    yield paths, everything
+    everything.close()
+
+
+def _same(shards, everything, query):
+    rows = [tuple(r) for r in shards.fetchall(query)]
+    assert rows == [tuple(r) for r in everything.fetchall(query)]
+    return rows
+
+
+ORDERED = [
+    Q.select(D.log).orderby(D.log.id),
+    Q.select(D.log).orderby(D.log.s).desc().orderby(D.log.v).orderby(D.log.id).desc(),
+    Q.select(D.log).columns(D.log.id, D.log.v.as_("val")).orderby(D.log.v).orderby(D.log.id).limit(50).offset(20),
+    Q.select(D.log).where(D.log.s == "x").orderby(D.log.id).desc().limit(7),
+]
+
+
+@pytest.mark.parametrize("query", ORDERED)
+def test_merged(shards, query):
+    paths, everything = shards
+    with SqlShards(paths, batch_size=16) as sharded:
+        _same(sharded, everything, query)
+
+
+def test_processes(shards):
+    paths, everything = shards
+    with SqlShards(paths, processes=True) as sharded:
+        assert len(_same(sharded, everything, ORDERED[1])) == 900
+
+
+def test_engines(shards):
+    paths, everything = shards
+    engines = [SqlEngine(p) for p in paths]
+    with SqlShards(engines) as sharded:
+        _same(sharded, everything, ORDERED[0])
+    assert engines[0].fetchone("SELECT COUNT(*) FROM log") == (300,)  # Not closed by the shards
+    for e in engines:
+        e.close()
+    with pytest.raises(SqlException):
+        SqlShards(engines, processes=True)
+
+
+def test_unordered(shards):
+    paths, everything = shards
+    with SqlShards(paths) as sharded:
+        assert len(sharded.fetchall(Q.select(D.log).limit(10).offset(295))) == 10
+        assert sorted(r.id for r in sharded.fetchall(Q.select(D.log))) == \
+            sorted(r[0] for r in everything.fetchall("SELECT id FROM log"))
+
+
+def test_stream_close(shards):
+    paths, _ = shards
+    with SqlShards(paths, batch_size=2, prefetch=1) as sharded:
+        rows = sharded.stream(Q.select(D.log).orderby(D.log.id))
+        assert next(rows).id == 0
+        rows.close()
+        assert len(sharded.fetchall(Q.select(D.log).orderby(D.log.id).limit(5))) == 5
+        sharded.stream(Q.select(D.log))  # Never iterated
+
+
+def test_errors(shards):
+    paths, _ = shards
+    with SqlShards(paths) as sharded:
+        with pytest.raises(SqlException):
+            sharded.fetchall(Q.select(D.log).columns(D.log.id).orderby(D.log.v))
+        with pytest.raises(Exception):
+            sharded.fetchall(Q.select(D.missing).orderby(D.missing.id))
+
+
+def test_union_all(engine):
+    query = Q.select(D.book).columns(D.book.id).where(D.book.year == 1995).union_all(
+        Q.select(D.book).columns(D.book.id).where(D.book.id == 5),
+        Q.select(D.author).columns(D.author.id))
+    assert query.build() == 'SELECT "book"."id" FROM "book" WHERE ("book"."year" = 1995) UNION ALL ' \
+                            'SELECT "book"."id" FROM "book" WHERE ("book"."id" = 5) UNION ALL ' \
+                            'SELECT "author"."id" FROM "author" ;'
+    assert sorted(r[0] for r in query.fetchall(engine)) == [1, 2, 3, 4, 5, 5, 5, 15, 25, 35, 45]
+
+    union = Q.select(D.book).columns(D.book.id).where(D.book.year == 1995).union(
+        Q.select(D.book).columns(D.book.id).where(D.book.id == 5))
+    assert len(union.fetchall(engine)) == 5
+
+    with pytest.raises(SqlException):
+        Q.select(D.book).union_all(Q.delete(D.book))
+    with pytest.raises(SqlException):
+        Q.delete(D.book).union_all(Q.select(D.book))
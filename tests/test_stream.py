@@ -0,0 +1,59 @@
+from pearsql import D, Q
+
+
+def test_row_names(engine):
+    query = Q.select(D.book).columns(D.book.id, D.book.title.as_("name")).where(D.book.id < 4).orderby(D.book.id)
+    rows = list(query.stream(engine))
+    assert [(r.id, r.name) for r in rows] == [(1, "book 1"), (2, "book 2"), (3, "book 3")]
+    assert rows[0] == (1, "book 1")
+    assert not hasattr(rows[0], "__dict__")
+
+
+def test_select_all(engine):
+    row = next(Q.select(D.author).where(D.author.id == 2).stream(engine))
+    assert row._fields == ("id", "name")
+    assert row.name == "author 2"
+
+
+def test_row_type_shared(engine):
+    query = Q.select(D.book).columns(D.book.id, D.book.year)
+    first = next(query.stream(engine))
+    second = next(engine.stream("SELECT title AS id, year FROM book"))
+    assert type(first) is type(second)
+
+
+def test_repeated_names(engine):
+    query = Q.select(D.book).columns(D.book.id, D.author.id).join(
+        D.author, D.author.id == D.book.author_id).where(D.book.id == 6)
+    row = next(query.stream(engine))
+    assert row[:2] == (6, 2)
+    assert row._fields[0] == "id" and row._fields[1] == "_1"
+
+
+def test_batches(engine):
+    for batch_size in (1, 7, 50, 1000):
+        query = Q.select(D.book).columns(D.book.id).orderby(D.book.id)
+        assert [r.id for r in query.stream(engine, batch_size=batch_size)] == list(range(1, 51))
+
+
+def test_params(engine):
+    template = Q.select(D.book).columns(D.book.title).where(D.book.id == Q.param("id")).compile()
+    assert [r.title for r in engine.stream(template, {"id": 9})] == ["book 9"]
+    assert [r[0] for r in engine.stream("SELECT title FROM book WHERE id = ?", (10,))] == ["book 10"]
+
+
+# Closing a stream early returns its connection to the pool
+def test_close_early(engine):
+    rows = Q.select(D.book).stream(engine, batch_size=5)
+    next(rows)
+    assert engine._idle.qsize() == 0
+    rows.close()
+    assert engine._idle.qsize() == 1
+
+
+def test_interleaved(engine):
+    ascending = Q.select(D.book).columns(D.book.id).orderby(D.book.id).stream(engine, batch_size=3)
+    descending = Q.select(D.book).columns(D.book.id).orderby(D.book.id).desc().stream(engine, batch_size=4)
+    pairs = [(a.id, d.id) for a, d in zip(ascending, descending)]
+    assert pairs[0] == (1, 50) and pairs[-1] == (50, 1) and len(pairs) == 50
+    assert engine._created == 1
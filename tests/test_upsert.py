@@ -0,0 +1,70 @@
+import pytest
+
+from pearsql import D, Q, SqlException
+
+UPSERT = Q.upsert(D.author).columns(D.author.id, D.author.name).conflict(D.author.id)
+UPDATE = Q.update(D.book).columns(D.book.id, D.book.title).match(D.book.id)
+
+
+def _run(engine, statements):
+    return sum(engine.execute(sql, params) for sql, params in statements)
+
+
+def test_upsert_sql():
+    assert Q.upsert(D.t).columns(D.t.id.set(1), D.t.name.set("x")).conflict(D.t.id).build() == \
+        'INSERT INTO "t" ("id", "name") VALUES (1, \'x\') ON CONFLICT ("id") DO UPDATE SET "name" = excluded."name" ;'
+    assert Q.insert(D.t).columns(D.t.id.set(1)).conflict(D.t.id).build_params() == \
+        ('INSERT INTO "t" ("id") VALUES (?) ON CONFLICT ("id") DO NOTHING ;', (1,))
+
+
+def test_upsert_rows(engine):
+    statements = list(UPSERT.rows((i, "new %i" % i) for i in range(3, 2003)))
+    assert len(statements) > 1  # Chunked to the parameter limit
+    _run(engine, statements)
+    assert engine.fetchone("SELECT COUNT(*) FROM author") == (2002,)
+    assert engine.fetchall("SELECT name FROM author WHERE id IN (1, 3, 2002) ORDER BY id") == \
+        [("author 1",), ("new 3",), ("new 2002",)]
+
+
+def test_upsert_executemany(engine):
+    assert engine.executemany(UPSERT, [(1, "x"), (9, "y")]) == 2
+    assert engine.fetchall("SELECT id, name FROM author WHERE id IN (1, 9) ORDER BY id") == [(1, "x"), (9, "y")]
+
+
+def test_update_sql():
+    query = Q.update(D.t).columns(D.t.id, D.t.name, D.t.score).match(D.t.id).where(D.t.score < 100)
+    assert list(query.rows([(1, "a", 1), (2, "b", 2)])) == [(
+        'UPDATE "t" SET "name" = "pearsql_values"."column2", "score" = "pearsql_values"."column3" '
+        'FROM (VALUES (?, ?, ?), (?, ?, ?)) AS "pearsql_values" '
+        'WHERE "t"."id" = "pearsql_values"."column1" AND ("t"."score" < 100) ;', (1, "a", 1, 2, "b", 2))]
+
+
+def test_update_rows(engine):
+    statements = list(UPDATE.rows((i, "title %i" % i) for i in range(0, 600)))
+    assert len(statements) > 1
+    assert _run(engine, statements) == 50  # Rows without a match are skipped
+    assert engine.fetchone("SELECT title FROM book WHERE id = 7") == ("title 7",)
+
+
+def test_update_where(engine):
+    query = Q.update(D.book).columns(D.book.title, D.book.id).match(D.book.id).where(D.book.year == 1995)
+    assert engine.executemany(query, [("x", 5), ("x", 6), ("x", 15)]) == 2
+    assert engine.fetchall("SELECT id FROM book WHERE title = 'x' ORDER BY id") == [(5,), (15,)]
+
+
+@pytest.mark.parametrize("make", [
+    lambda: list(Q.update(D.t).columns(D.t.id).rows([(1,)])),
+    lambda: list(Q.update(D.t).columns(D.t.id).match(D.t.id).rows([(1,)])),
+    lambda: list(Q.update(D.t).columns(D.t.id).match(D.t.x).rows([(1,)])),
+    lambda: Q.upsert(D.t).columns(D.t.id.set(1)).build(),
+    lambda: Q.select(D.t).conflict(D.t.id),
+    lambda: list(UPSERT.rows([(1,)])),
+])
+def test_errors(make):
+    with pytest.raises(SqlException):
+        make()
+
+
+def test_structural_key():
+    assert UPSERT.structural_key() != Q.insert(D.author).columns(D.author.id, D.author.name).structural_key()
+    assert UPDATE.structural_key() != Q.update(D.book).columns(D.book.id, D.book.title).structural_key()
@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from pearsql import D, Q, SqlException
+from pearsql.cache import SqlResultCache
+from pearsql.engine import SqlEngine
+from pearsql.instrument import add_hook, remove_hook
+from pearsql.writer import SqlWriteQueue
+
+
+def _insert(i):
+    return Q.insert(D.author).columns(D.author.id.set(i), D.author.name.set("author %i" % i))
+
+
+def test_submit(engine):
+    with SqlWriteQueue(engine) as writes:
+        futures = [writes.submit(_insert(i)) for i in range(6, 106)]
+        update = writes.submit(Q.update(D.book).columns(D.book.title.set("x")).where(D.book.year == 1990))
+        plain = writes.submit("DELETE FROM book WHERE id = ?", (1,))
+        assert [f.result(5) for f in futures] == [1] * 100
+        assert update.result(5) == 5 and plain.result(5) == 1
+    assert engine.fetchone("SELECT COUNT(*) FROM author") == (105,)
+
+
+# Runs of same-shape inserts are executed with one executemany()
+def test_merged(engine):
+    executed = []
+    hook = add_hook(lambda event: event.kind == "execute" and executed.append(event.params))
+    try:
+        writes = SqlWriteQueue(engine, max_delay=1)
+        futures = [writes.submit(_insert(i)) for i in range(6, 26)]
+        writes.flush(5)
+        writes.close()
+    finally:
+        remove_hook(hook)
+    assert all(f.result() == 1 for f in futures)
+    assert len(executed) < 20 and None in executed
+
+
+def test_failing_write(engine):
+    with SqlWriteQueue(engine, max_delay=1) as writes:
+        futures = [writes.submit(_insert(i)) for i in (6, 7, 1, 8)]  # 1 exists
+        writes.flush(5)
+    assert [f.exception() is None for f in futures] == [True, True, False, True]
+    assert "UNIQUE" in str(futures[2].exception())
+    assert engine.fetchall("SELECT id FROM author WHERE id > 5 ORDER BY id") == [(6,), (7,), (8,)]
+
+
+def test_query_copied(engine):
+    query = _insert(6)
+    with SqlWriteQueue(engine) as writes:
+        future = writes.submit(query)
+        query.columns(D.author.id.set(7))
+    future.result(5)
+    assert engine.fetchall("SELECT id FROM author WHERE id > 5") == [(6,)]
+
+
+def test_threads(engine):
+    with SqlWriteQueue(engine, max_batch=7) as writes:
+        futures = []
+
+        def submit(start):
+            futures.extend(writes.submit(_insert(i)) for i in range(start, start + 50))
+
+        threads = [threading.Thread(target=submit, args=(s,)) for s in range(100, 500, 50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert all(f.result(5) == 1 for f in futures)
+    assert engine.fetchone("SELECT COUNT(*) FROM author") == (405,)
+
+
+def test_closed(engine):
+    writes = SqlWriteQueue(engine)
+    writes.close()
+    writes.close()
+    writes.flush()
+    with pytest.raises(SqlException):
+        writes.submit(_insert(6))
+
+
+def test_cache_invalidated(engine, database):
+    cached = SqlEngine(database, cache=SqlResultCache())
+    query = Q.select(D.author)
+    assert len(query.fetchall(cached)) == 5
+    with SqlWriteQueue(cached) as writes:
+        writes.submit(_insert(6)).result(5)
+    assert len(query.fetchall(cached)) == 6
+    cached.close()